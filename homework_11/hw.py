@@ -1,12 +1,118 @@
+import os
+import json
+import time
+import hashlib
 import numpy as np
 from scipy import sparse
 from collections import defaultdict
+from multiprocessing import Pool
+
+
+def _decode_chunk(args):
+    # runs in a worker process of HMM.predict
+    model, X = args
+    return model._predict(X)
+
+
+def _hash(state):
+    # stable 64-bit hash of a state, the same in every process
+    return int.from_bytes(hashlib.blake2b(str(state).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class MappedStates:
+    """
+    read-only lookup state -> index over arrays of states sorted by hash, they may be memory-mapped
+    """
+    def __init__(self, idx2state, hashes, order):
+        self.idx2state = idx2state
+        self.hashes = hashes
+        self.order = order
+
+    def __len__(self):
+        return len(self.idx2state)
+
+    def get(self, state, default=None):
+        h = np.uint64(_hash(state))
+        i = np.searchsorted(self.hashes, h)
+        while i < len(self.hashes) and self.hashes[i] == h:
+            idx = int(self.order[i])
+            if self.idx2state[idx] == state:
+                return idx
+            i += 1
+        return default
+
+    def __getitem__(self, state):
+        idx = self.get(state)
+        if idx is None:
+            raise KeyError(state)
+        return idx
+
 
 class HMM:
     START = '*'
-    TERM = '$'
+    TERM = '<TERM>' # not '$', which is a tag of the treebank
     REST = '$REST$' # to deal with observed states who have never appeared in train dataset.
 
+    def __init__(self, beam_width=None):
+        # only beam_width best pairs (u, v) are kept at every step of decoding, None is exact Viterbi
+        self.beam_width = beam_width
+
+    def save(self, path):
+        """
+        Save the trained model to the directory path: log-probability tables and states as .npy
+        observed states are stored with their sorted hashes, so loading needs no dict
+        """
+        os.makedirs(path, exist_ok=True)
+        hashes = np.array([_hash(state) for state in self.observed_idx2state], dtype=np.uint64)
+        order = np.argsort(hashes, kind='stable')
+
+        np.save(os.path.join(path, 'log_A.npy'), self.log_A)
+        np.save(os.path.join(path, 'log_B.npy'), self.log_B)
+        np.save(os.path.join(path, 'hidden.npy'), np.array(self.hidden_idx2state, dtype=str))
+        np.save(os.path.join(path, 'observed.npy'), np.array(self.observed_idx2state, dtype=str))
+        np.save(os.path.join(path, 'observed_hash.npy'), hashes[order])
+        np.save(os.path.join(path, 'observed_order.npy'), order)
+        with open(os.path.join(path, 'model.json'), 'w') as f:
+            json.dump({'beam_width': self.beam_width}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load the model saved by save(), it can only decode
+        with mmap=True arrays are memory-mapped read-only, so all processes share one copy
+        """
+        with open(os.path.join(path, 'model.json')) as f:
+            model = cls(**json.load(f))
+        model._load_tables(path, mmap)
+        return model
+
+    def _load_tables(self, path, mmap):
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+
+        self.log_A = load('log_A')
+        self.log_B = load('log_B')
+        self.h_dim, self.o_dim = self.log_B.shape
+
+        self.hidden_idx2state = load('hidden').tolist()
+        self.hidden_states = {state: i for i, state in enumerate(self.hidden_idx2state)}
+        self.observed_idx2state = load('observed')
+        self.observed_states = MappedStates(self.observed_idx2state, load('observed_hash'), load('observed_order'))
+        self._rest_idx = self.observed_states[self.REST]
+
+        self._mmap_path = path if mmap else None
+
+    def __getstate__(self):
+        # memory-mapped models are sent to worker processes by path, not by value
+        if getattr(self, '_mmap_path', None):
+            return {'beam_width': self.beam_width, '_mmap_path': self._mmap_path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state.get('_mmap_path'):
+            self._load_tables(state['_mmap_path'], mmap=True)
+
     def cond_idx(self, u, v):
         return u + v*self.h_dim
 
@@ -18,30 +124,42 @@ class HMM:
         """
 
         #######################
-        # YOUR CODE HERE
-
-        self.hidden_idx2state = ([list(var) for var in set(tuple(var) for var in y)])
-        self.hidden_idx2state.append([self.START, self.TERM])
-        self.hidden_states = dict()
-        for items in self.hidden_idx2state:
-            self.hidden_states[len(items)] = items;
-                    
-        self.h_dim = len(self.hidden_states)
-
-        self.observed_idx2state = [list(var) for var in set(tuple(var) for var in X)].append([self.START, self.TERM])
-        self.observed_states = dict();
-        for items in self.observed_idx2state:
-            self.observed_states[len(items)] = items;
-
-        self.o_dim=len(self.observed_states)
-
+        # states are coded by integer indices in the order of first appearance
+        self.hidden_idx2state = [self.START, self.TERM]
+        self.hidden_states = {self.START: 0, self.TERM: 1}
+        self.observed_idx2state = [self.REST]
+        self.observed_states = {self.REST: 0}
+        self._rest_idx = 0 # index of REST, the default of o_state
+
+        # every sequence of hidden states is padded, eg {a, b} -> {START, START, a, b, TERM}
+        tags, emitted, words = [], [], []
+        for seq_x, seq_y in zip(X, y):
+            tags.extend([0, 0])
+            first = len(emitted)
+            for x, tag in zip(seq_x, seq_y):
+                emitted.append(self.hidden_states.setdefault(tag, len(self.hidden_idx2state)))
+                if len(self.hidden_states) > len(self.hidden_idx2state):
+                    self.hidden_idx2state.append(tag)
+                words.append(self.observed_states.setdefault(x, len(self.observed_idx2state)))
+                if len(self.observed_states) > len(self.observed_idx2state):
+                    self.observed_idx2state.append(x)
+            tags.extend(emitted[first:])
+            tags.append(1)
+
+        self.h_dim = len(self.hidden_idx2state)
+        self.o_dim = len(self.observed_idx2state)
+
+        tags = np.array(tags, dtype=int)
+        emitted = np.array(emitted, dtype=int)
+        words = np.array(words, dtype=int)
         #######################
 
 
         #######################
         # estimate emission matrix
-        # YOUR CODE HERE
-        self.B =sparse.csr_matrix( (self.h_dim,self.o_dim) )
+        # counts of (tag, word) pairs, duplicates are summed by the coo -> csr conversion
+        self.B = sparse.coo_matrix((np.ones(len(words)), (emitted, words)),
+                                   shape=(self.h_dim, self.o_dim)).tocsr()
 
         #######################
 
@@ -50,35 +168,49 @@ class HMM:
 
         ########################
         # transition matrix
-        # YOUR CODE HERE
-        self.A = sparse.csr_matrix( (self.h_dim **2,self.h_dim))
-        sparse.csr_matrix.todense(self.A)
-
+        # counts of trigrams (w, u, v) in the rows cond_idx(w, u), the column is v
+        # the first two tags of every padded sequence are START, so v is never START
+        w, u, v = tags[:-2], tags[1:-1], tags[2:]
+        trigram = v != 0
+        self.A = sparse.coo_matrix((np.ones(trigram.sum()), (self.cond_idx(w, u)[trigram], v[trigram])),
+                                   shape=(self.h_dim ** 2, self.h_dim)).tocsr()
 
-        #remember about padding for sequence of hidden states, eg {a, b} -> {START, START, a, b, TERM}
         ########################
 
         self.A_rowsum = np.ravel(self.A.sum(axis=1))
 
+        self._log_probs()
+
         return self
 
+    def _log_probs(self):
+        """
+        precompute Laplace smoothed log-probabilities once, so decoding never calls np.log
+        log_A[w, u, v] = log q(v | w, u), log_B[j, k] = log e(x_k | j)
+        """
+        A = self.A.toarray() if sparse.issparse(self.A) else np.asarray(self.A)
+        B = self.B.toarray() if sparse.issparse(self.B) else np.asarray(self.B)
+
+        log_A = np.log(A + 1) - np.log(self.A_rowsum + self.h_dim)[:, None]
+        # rows of A are cond_idx(w, u) = w + u*h_dim
+        self.log_A = log_A.reshape(self.h_dim, self.h_dim, self.h_dim).transpose(1, 0, 2).copy()
+        self.log_B = np.log(B + 1) - np.log(self.B_rowsum + self.o_dim)[:, None]
+
     def tr_prob(self, i, j):
         """
         A_ij = q(j | i) = q(j| u, v) with Laplace smoothing
         """
         ########################
-        # YOUR CODE HERE
-        result = (j*i+1)/(i + self.v)
+        result = (self.A[i, j] + 1) / (self.A_rowsum[i] + self.h_dim)
         ########################
         return result
 
     def em_prob(self, i, j):
         """
-        B_jk = e(x_k| j) with Laplace smoothing
+        B_ij = e(x_j| i) with Laplace smoothing
         """
         ########################
-        # YOUR CODE HERE
-        result = (x_k*j + 1)/(j + self.v)
+        result = (self.B[i, j] + 1) / (self.B_rowsum[i] + self.o_dim)
         ########################
         return result
 
@@ -86,17 +218,113 @@ class HMM:
         """
         return index of obseved state
         """
-        return self.observed_states.get(x, self.observed_states[self.REST])
+        return self.observed_states.get(x, self._rest_idx)
 
 
-    def predict(self, X):
+    def predict(self, X, n_jobs=1):
         """
         Predict the most probable sequence of hidden states for every sequence of observed states
         X - list of lists
+        n_jobs - number of worker processes, every one decodes its own chunk of X
         """
+        X = list(X)
+        if n_jobs > 1 and len(X) > 1:
+            chunk = -(-len(X) // n_jobs)
+            with Pool(n_jobs) as pool:
+                chunks = pool.map(_decode_chunk, [(self, X[i:i + chunk]) for i in range(0, len(X), chunk)])
+            return [y for y_pred in chunks for y in y_pred]
+
+        return self._predict(X)
+
+    def _predict(self, X):
+        if self.beam_width:
+            return [self._viterbi_beam(seq) for seq in X]
+        return self._decode(X)
+
+    def _decode(self, X):
         y_pred = [self._viterbi(seq) for seq in X]
         return y_pred
 
+    def log_prob(self, X, y):
+        """
+        log-probability of the sequence of hidden states y together with observed states X
+        """
+        start_idx = self.hidden_states[self.START]
+        h_states = [start_idx, start_idx] + [self.hidden_states[tag] for tag in y] + [self.hidden_states[self.TERM]]
+
+        result = sum(self.log_B[self.hidden_states[tag], self.o_state(x)] for x, tag in zip(X, y))
+        for k in range(2, len(h_states)):
+            result += self.log_A[h_states[k-2], h_states[k-1], h_states[k]]
+        return result
+
+    def beam_gap(self, X):
+        """
+        Compare beam decoding with exact decoding on the validation sequences X
+        returns how far the log-probabilities of beam paths fall short of the exact ones,
+        the share of sequences decoded exactly and the speedup of decoding
+        """
+        X = list(X)
+        if not X:
+            raise ValueError('beam_gap needs at least one sequence')
+
+        start = time.time()
+        beam = [self._viterbi_beam(seq) for seq in X]
+        beam_time = time.time() - start
+
+        start = time.time()
+        exact = self._decode(X)
+        exact_time = time.time() - start
+
+        gaps = np.array([self.log_prob(seq, e) - self.log_prob(seq, b) for seq, e, b in zip(X, exact, beam)])
+        return {
+            'mean_gap': float(gaps.mean()),
+            'max_gap': float(gaps.max()),
+            'exact_share': float(np.mean([e == b for e, b in zip(exact, beam)])),
+            'speedup': exact_time / beam_time,
+        }
+
+    def _viterbi_beam(self, X):
+        """
+        Approximate Viterbi, only beam_width best pairs (u, v) are kept at every step
+        every step costs O(beam_width * h_dim) instead of O(h_dim ** 3)
+        """
+        T = len(X)
+        H = self.h_dim
+
+        # active pairs (u, v) coded as u*H + v and their log-scores
+        start_idx = self.hidden_states[self.START]
+        keys = np.array([start_idx * H + start_idx])
+        scores = np.zeros(1)
+        # bp[t-1] maps every kept pair (u, v) of step t to its best w
+        bp = []
+
+        for k in range(1, T + 1):
+            xk = self.o_state(X[k-1])
+            w, u = np.divmod(keys, H)
+
+            # r[i, v] = pi[w_i, u_i] + log q(v | w_i, u_i) + log e(x_k | v)
+            r = (scores[:, None] + self.log_A[w, u] + self.log_B[:, xk]).ravel()
+            new_keys = (u[:, None] * H + np.arange(H)).ravel()
+
+            # the best w for every new pair (u, v), then the best pairs
+            order = np.lexsort((-r, new_keys))
+            best = order[np.r_[True, new_keys[order][1:] != new_keys[order][:-1]]]
+            if len(best) > self.beam_width:
+                best = best[np.argpartition(-r[best], self.beam_width - 1)[:self.beam_width]]
+
+            keys, scores = new_keys[best], r[best]
+            bp.append(dict(zip(keys.tolist(), w[best // H].tolist())))
+
+        term_idx = self.hidden_states[self.TERM]
+        u, v = np.divmod(keys, H)
+        best = np.argmax(scores + self.log_A[u, v, term_idx])
+
+        h_states = [v[best], u[best]]
+        for k in range(T, 2, -1):
+            h_states.append(bp[k-1][h_states[-1] * H + h_states[-2]])
+
+        return [self.hidden_idx2state[i] for i in reversed(h_states[:T])]
+
     def _viterbi(self, X):
         """
         X - list of observables
@@ -107,27 +335,27 @@ class HMM:
         T = len(X)
 
         # pi[t, u, v] - max probability for any state sequence ending with x_t = v and x_{t-1} = u.
-        pi = np.zeros((T + 1, self.h_dim, self.h_dim))
+        pi = np.full((T + 1, self.h_dim, self.h_dim), -np.inf)
         # backpointers, bp[t, u, v] = argmax probability for any state sequence ending with x_t = v and x_{t-1} = u.
-        bp = np.zeros((T + 1, self.h_dim, self.h_dim), dtype=np.int)
+        bp = np.zeros((T + 1, self.h_dim, self.h_dim), dtype=int)
+
+        start_idx = self.hidden_states[self.START]
+        pi[0, start_idx, start_idx] = 0
 
         ###################
         # fill tables pi and bp
         # pi[t, u, v] = max_{w} [ pi[t-1, w, u] * q(v| w, u) * e(x_k| v) ]
         # bp[t, u, v] = argmax_{w} [ pi[t-1, w, u] * q(v| w, u) * e(x_k| v) ]
-        # YOUR CODE HERE
+        # in log space products become sums of the precomputed log_A and log_B
         for k in range(1, T + 1):
-             xk = self.o_state(X[k-1])
-
-             for v in range(self.h_dim):
-                 log_b_smoothed = np.log(b)
-                 for u in range(self.h_dim):
-                     r = np.zeros(self.h_dim)
-                     for w in range(self.h_dim):
-                         log_a_smoothed = np.log(a)
-                         r[w] = log_b_smoothed/log_a_smoothed
-                     bp[k, u, v] = np.argmax(r)
-                     pi[k, u, v] = np.max(r)
+            xk = self.o_state(X[k-1])
+
+            for v in range(self.h_dim):
+                log_b = self.log_B[v, xk]
+                for u in range(self.h_dim):
+                    r = pi[k-1, :, u] + self.log_A[:, u, v] + log_b
+                    bp[k, u, v] = np.argmax(r)
+                    pi[k, u, v] = r[bp[k, u, v]]
 
         ###################
 
@@ -136,8 +364,8 @@ class HMM:
         ###################
         # r(u,v) = pi[T, u, v] * q(TERM | u, v)
         # find argmax_{u, v} r(u, v)
-        # YOUR CODE HERE
-        u, v = pi[u, v]
+        r = pi[T] + self.log_A[:, :, term_idx]
+        u, v = np.unravel_index(np.argmax(r), r.shape)
         ###################
 
         h_states = [v, u]
@@ -145,8 +373,8 @@ class HMM:
         # rollback backpointers
         # y_{t-2} = bp[t, y_{t-1}, y_t]
         # h_states is a reversed sequence of hidden states
-        # YOUR CODE HERE
-        h_states = y.reverse()
+        for k in range(T, 2, -1):
+            h_states.append(bp[k, h_states[-1], h_states[-2]])
 
         ###################
 
@@ -154,38 +382,69 @@ class HMM:
 
 
 
-import nltk
-nltk.download('treebank')
-from nltk.corpus import treebank
-from sklearn import metrics
+def accuracy(y_true, y_pred):
+    y_true = np.concatenate(y_true)
+    y_pred = np.concatenate(y_pred)
+
+    return np.mean(y_true == y_pred)
 
-data = treebank.tagged_sents()[:3000]
-test_data = treebank.tagged_sents()[3000:3010]
 
-X_train = [[x[0] for x in y] for y in data]
-y_train = [[x[1] for x in y] for y in data]
+class HmmVectorized(HMM):
+    # number of sentences decoded together, memory is batch_size * h_dim**3 floats
+    batch_size = 64
+    
+    def _decode(self, X):
+        """
+        Sentences are bucketed by length and every bucket is decoded by batches
+        """
+        by_length = defaultdict(list)
+        for i, seq in enumerate(X):
+            by_length[len(seq)].append(i)
+
+        y_pred = [None] * len(X)
+        for idx in by_length.values():
+            for start in range(0, len(idx), self.batch_size):
+                batch = idx[start:start + self.batch_size]
+                for i, y in zip(batch, self._viterbi_batch([X[i] for i in batch])):
+                    y_pred[i] = y
+        return y_pred
+
+    def _viterbi_batch(self, batch):
+        """
+        Viterbi for sentences of the same length, the state is a (batch, H, H) array
+        and every time step is shared by all sentences of the batch
+        """
+        N, T = len(batch), len(batch[0])
+        obs = np.array([[self.o_state(x) for x in X] for X in batch], dtype=int).reshape(N, T)
 
-X_test = [[x[0] for x in y] for y in test_data]
-y_test = [[x[1] for x in y] for y in test_data]
+        pi_prev = np.full((N, self.h_dim, self.h_dim), -np.inf)
+        bp = np.zeros((T + 1, N, self.h_dim, self.h_dim), dtype=np.min_scalar_type(self.h_dim))
 
-print('sentence: ', " ".join(X_train[0]))
-print('tags: ', " ".join(y_train[0]))
+        start_idx = self.hidden_states[self.START]
+        pi_prev[:, start_idx, start_idx] = 0
 
-def accuracy(y_true, y_pred):
-    y_true = np.concatenate(y_true)
-    y_pred = np.concatenate(y_pred)
+        # w is the last axis, so max and argmax over it run on contiguous memory
+        log_A = np.ascontiguousarray(self.log_A.transpose(1, 2, 0))
+        r = np.empty((N, self.h_dim, self.h_dim, self.h_dim))
 
-    return np.mean(y_true == y_pred)
+        for k in range(1, T + 1):
+            # r[n, u, v, w] = pi_prev[n, w, u] + log q(v | w, u), e(x_k | v) does not depend on w
+            np.add(pi_prev.transpose(0, 2, 1)[:, :, None, :], log_A, out=r)
+            bp[k] = r.argmax(axis=3)
+            pi_prev = r.max(axis=3) + self.log_B[:, obs[:, k-1]].T[:, None, :]
 
-#%%time
+        term_idx = self.hidden_states[self.TERM]
+        r = pi_prev + self.log_A[:, :, term_idx]
+        u, v = np.divmod(np.argmax(r.reshape(N, -1), axis=1), self.h_dim)
 
-hh = HMM().fit(X_train, y_train)
-y_pred = hh.predict(X_test)
-print(accuracy(y_test, y_pred))
+        rows = np.arange(N)
+        h_states = [v, u]
+        for k in range(T, 2, -1):
+            h_states.append(bp[k, rows, h_states[-1], h_states[-2]].astype(int))
 
+        h_states = np.array(h_states[:T], dtype=int).reshape(-1, N)[::-1].T
+        return [[self.hidden_idx2state[i] for i in seq] for seq in h_states]
 
-class HmmVectorized(HMM):
-    
     def _viterbi(self, X):
         """
         Vectorized version of Viterbi. Let's speed up!
@@ -194,32 +453,24 @@ class HmmVectorized(HMM):
         T = len(X)
         
         # One may notice, at every step t we only need pi[t-1, u, v] = pi_prev[u,v] to compute pi[t, u, v] = pi_curr[u,v]
-        pi_prev = np.zeros((self.h_dim, self.h_dim))
+        pi_prev = np.full((self.h_dim, self.h_dim), -np.inf)
         
         # backpointers
-        bp = np.zeros((T + 1, self.h_dim, self.h_dim), dtype=np.int)
+        bp = np.zeros((T + 1, self.h_dim, self.h_dim), dtype=int)
         
-        a_rowsum = self.A_rowsum.reshape(self.h_dim, self.h_dim)
+        start_idx = self.hidden_states[self.START]
+        pi_prev[start_idx, start_idx] = 0
         
         ###################
         # fill pi and bp
         # pi_curr[u, v] = max_{w} [ pi_prev[w, u] * q(v| w, u) * e(x_k| v) ]
         # bp[t, u, v] = argmax_{w} [ pi_prev[w, u] * q(v| w, u) * e(x_k| v) ]
-        # don't use tr_prob() and em_prob(), apply laplace smoothing directly here
-        # YOUR CODE HERE
-         for k in range(1, T + 1):            
-             xk = self.o_state(X[k-1])
-             pi_curr = np.zeros_like(pi_prev)
-            # r(u,v) = pi[T, u, v] * q(TERM | u, v)
-             for v in range(self.h_dim):
-                 log_b_smoothed = np.log(b)
-                 a = self.A[:, v].reshape(self.h_dim, self.h_dim)
-                 log_a_smoothed = np.log(a)
-                 r =  pi_curr*v
-                 bp[k, :, v] = np.argmax(r, axis=1)
-                 pi_curr[:, v] = np.max(r, axis=1)
-                    
-             pi_prev = pi_curr
+        # every step is one (w, u, v) tensor of log-scores reduced over w
+        for k in range(1, T + 1):
+            xk = self.o_state(X[k-1])
+            r = pi_prev[:, :, None] + self.log_A + self.log_B[:, xk]
+            bp[k] = np.argmax(r, axis=0)
+            pi_prev = np.take_along_axis(r, bp[k][None], axis=0)[0]
         ###################
         
         term_idx = self.hidden_states[self.TERM]
@@ -228,8 +479,8 @@ class HmmVectorized(HMM):
         # r(u,v) = pi[T, u, v] * q(TERM | u, v)
         # find argmax_{u, v} r(u, v)
         # express r(u,v) as matrix additions
-        # YOUR CODE HERE
-        # u, v = 
+        r = pi_prev + self.log_A[:, :, term_idx]
+        u, v = np.unravel_index(np.argmax(r), r.shape)
         ###################
         
         h_states = [v, u]
@@ -237,9 +488,35 @@ class HmmVectorized(HMM):
         # rollback backpointers
         # y_{t-2} = bp[t, y_{t-1}, y_t]
         # h_states is a reversed sequence of hidden states
-        # YOUR CODE HERE
-        # h_states = 
+        for k in range(T, 2, -1):
+            h_states.append(bp[k, h_states[-1], h_states[-2]])
             
         ###################
         
         return [self.hidden_idx2state[i] for i in reversed(h_states[:T])]
+
+
+# the treebank is downloaded and the model trained only when the file is run
+if __name__ == '__main__':
+    import nltk
+    nltk.download('treebank')
+    from nltk.corpus import treebank
+    from sklearn import metrics
+
+    data = treebank.tagged_sents()[:3000]
+    test_data = treebank.tagged_sents()[3000:3010]
+
+    X_train = [[x[0] for x in y] for y in data]
+    y_train = [[x[1] for x in y] for y in data]
+
+    X_test = [[x[0] for x in y] for y in test_data]
+    y_test = [[x[1] for x in y] for y in test_data]
+
+    print('sentence: ', " ".join(X_train[0]))
+    print('tags: ', " ".join(y_train[0]))
+
+    #%%time
+
+    hh = HmmVectorized().fit(X_train, y_train)
+    y_pred = hh.predict(X_test)
+    print(accuracy(y_test, y_pred))
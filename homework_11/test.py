@@ -0,0 +1,88 @@
+import itertools
+import random
+import shutil
+import tempfile
+import unittest
+
+from hw import HMM, HmmVectorized
+
+
+def tagged_sentences(count, seed=0):
+    # sentences of a toy grammar, words are ambiguous between tags
+    generator = random.Random(seed)
+    words = {'D': ['the', 'a'], 'N': ['dog', 'cat', 'run'], 'V': ['run', 'saw', 'cat']}
+    X, y = [], []
+    for _ in range(count):
+        tags = ['D', 'N', 'V'] + generator.choice([[], ['D', 'N'], ['N']])
+        X.append([generator.choice(words[tag]) for tag in tags])
+        y.append(tags)
+    return X, y
+
+
+class TestHMM(unittest.TestCase):
+    def setUp(self):
+        self.X_train, self.y_train = tagged_sentences(200)
+        self.model = HmmVectorized().fit(self.X_train, self.y_train)
+        # all lengths up to 4, with a word never seen in train
+        words = ['the', 'cat', 'run', 'saw', 'unknown']
+        self.X = [list(seq) for length in range(1, 5) for seq in itertools.islice(
+            itertools.product(words, repeat=length), 0, None, 7)]
+
+    def test_viterbi_is_best_path(self):
+        for seq in self.X:
+            best = max(self.model.log_prob(seq, tags)
+                       for tags in itertools.product(self.model.hidden_idx2state, repeat=len(seq)))
+            for decode in (HMM._viterbi, HmmVectorized._viterbi):
+                self.assertAlmostEqual(self.model.log_prob(seq, decode(self.model, seq)), best)
+
+    def test_batch_is_same_as_single(self):
+        self.assertEqual(self.model.predict(self.X), [self.model._viterbi(seq) for seq in self.X])
+
+    def test_wide_beam_is_exact(self):
+        beam = HmmVectorized(beam_width=self.model.h_dim ** 2).fit(self.X_train, self.y_train)
+        for seq in self.X:
+            self.assertAlmostEqual(self.model.log_prob(seq, beam.predict([seq])[0]),
+                                   self.model.log_prob(seq, self.model._viterbi(seq)))
+
+    def test_narrow_beam_is_not_better_than_exact(self):
+        for beam_width in (1, 2, 3):
+            beam = HmmVectorized(beam_width=beam_width).fit(self.X_train, self.y_train)
+            for seq in self.X:
+                self.assertLessEqual(self.model.log_prob(seq, beam.predict([seq])[0]),
+                                     self.model.log_prob(seq, self.model._viterbi(seq)) + 1e-9)
+
+    def test_beam_gap(self):
+        beam = HmmVectorized(beam_width=2).fit(self.X_train, self.y_train)
+        gap = beam.beam_gap(self.X)
+        self.assertEqual(sorted(gap), ['exact_share', 'max_gap', 'mean_gap', 'speedup'])
+        self.assertTrue(0 <= gap['exact_share'] <= 1)
+        self.assertGreaterEqual(gap['mean_gap'], 0)
+        for seq in self.X:
+            self.assertGreaterEqual(beam.beam_gap([seq])['max_gap'], -1e-9)
+        with self.assertRaises(ValueError):
+            beam.beam_gap([])
+
+    def test_dollar_tag_is_not_end_of_sentence(self):
+        X = [['costs', '$', '5']] * 50 + [['the', 'dog']] * 50
+        y = [['VBZ', '$', 'CD']] * 50 + [['DT', 'NN']] * 50
+        model = HmmVectorized().fit(X, y)
+
+        start, term = model.hidden_states[model.START], model.hidden_states[model.TERM]
+        self.assertNotEqual(model.hidden_states['$'], term)
+        self.assertEqual(model.A[model.cond_idx(start, model.hidden_states['VBZ']), term], 0)
+        self.assertEqual(model.predict([['costs', '$', '5']]), [['VBZ', '$', 'CD']])
+
+    def test_save_and_load(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.model.save(path)
+            for mmap in (True, False):
+                model = HmmVectorized.load(path, mmap=mmap)
+                self.assertEqual(model.predict(self.X), self.model.predict(self.X))
+                self.assertEqual(model.o_state('unknown'), self.model.o_state('unknown'))
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,15 @@
 #-*- coding: utf-8 -*-
+from __future__ import division
 import re
+import math
+import heapq
+import random
+import hashlib
+from array import array
 from collections import Counter
+from operator import itemgetter
+
+import numpy as np
 
 from pattern.web import Wikipedia
 from pattern.web import plaintext
@@ -33,33 +42,208 @@ class WikiParser:
         return atricles[:max_count]
 
 
+class CountMinSketch:
+    # Every row has its own hash (a * h + b) mod prime of the item key h
+    prime = (1 << 61) - 1
+
+    def __init__(self, epsilon=0.001, delta=0.01, seed=0):
+        # An estimate exceeds the true count by more than epsilon * N
+        # (N is the total count) with probability at most delta
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.table = [array('l', [0] * self.width) for _ in range(self.depth)]
+        generator = random.Random(seed)
+        self.hashes = [(generator.randint(1, self.prime - 1), generator.randint(0, self.prime - 1))
+                       for _ in range(self.depth)]
+
+    @staticmethod
+    def _key(item):
+        # 60 bits of md5, unlike hash() the same in every run
+        if not isinstance(item, bytes):
+            item = (u'%s' % (item,)).encode('utf-8')
+        return int(hashlib.md5(item).hexdigest()[:15], 16)
+
+    def _cells(self, item):
+        key = self._key(item)
+        return [(row, (a * key + b) % self.prime % self.width) for row, (a, b) in enumerate(self.hashes)]
+
+    def add(self, item, count=1):
+        # Returns the new estimate of the item count
+        estimate = None
+        for row, column in self._cells(item):
+            self.table[row][column] += count
+            if estimate is None or self.table[row][column] < estimate:
+                estimate = self.table[row][column]
+        return estimate
+
+    def estimate(self, item):
+        return min(self.table[row][column] for row, column in self._cells(item))
+
+
+class HeavyHitters:
+    # Approximate Counter of fixed size: counts are estimated by a
+    # Count-Min Sketch and only `capacity` items with the largest
+    # estimates are remembered
+    def __init__(self, capacity=1000, epsilon=0.001, delta=0.01):
+        self.capacity = capacity
+        self.sketch = CountMinSketch(epsilon, delta)
+        self.top = {}
+        # Min-heap of (estimate, item), entries outdated by `top` are skipped
+        self._heap = []
+
+    def update(self, items):
+        # Like Counter.update, `items` is an iterable or a mapping of counts
+        if hasattr(items, 'items'):
+            items = items.items()
+        else:
+            items = ((item, 1) for item in items)
+
+        for item, count in items:
+            self._offer(item, self.sketch.add(item, count))
+
+    def _offer(self, item, estimate):
+        if item not in self.top and len(self.top) >= self.capacity:
+            if not self.top:
+                return
+            while self._heap[0][0] != self.top.get(self._heap[0][1]):
+                heapq.heappop(self._heap)
+            if estimate <= self._heap[0][0]:
+                return
+            del self.top[heapq.heappop(self._heap)[1]]
+
+        self.top[item] = estimate
+        heapq.heappush(self._heap, (estimate, item))
+
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, count in self.top.items()]
+            heapq.heapify(self._heap)
+
+    def most_common(self, n=None):
+        return heapq.nlargest(len(self.top) if n is None else n, self.top.items(), key=itemgetter(1))
+
+
 class TextStatistics:
-    def __init__(self, articles):
-        self.articles = articles
-        self.articles_in_one_line = ' '.join(self.articles)
-        stop_words = ['the', 'of', 'and', 'a', 'in', 'to', 'is', 'for', 'as',
-            'an', 'this', 'at', 'not', 'which', 'that', 'are', 'on', 'by', 'or',
-            'be', 'with', 's', 'it', 'from']
-        self.words = filter(lambda x: x not in stop_words,
-                            re.findall(r'\w+', self.articles_in_one_line))
+    stop_words = ['the', 'of', 'and', 'a', 'in', 'to', 'is', 'for', 'as',
+        'an', 'this', 'at', 'not', 'which', 'that', 'are', 'on', 'by', 'or',
+        'be', 'with', 's', 'it', 'from']
+    # Trigrams are packed into one integer by 21 bits per word id, a
+    # larger vocabulary is counted by triples of ids
+    id_bits = 21
+
+    def __init__(self, articles=(), approximate=False, capacity=1000, epsilon=0.001, delta=0.01):
+        # In the approximate mode the counters are HeavyHitters, which
+        # take a fixed amount of memory whatever the size of the corpus.
+        # Words and trigrams are counted there as strings, as a vocabulary
+        # of all the words would grow with the corpus
+        self.approximate = approximate
+        if approximate:
+            new_counter = lambda: HeavyHitters(capacity, epsilon, delta)
+        else:
+            new_counter = Counter
+
+        self.articles_count = 0
+        # In the exact mode words are counted by integer ids and decoded
+        # only for the top
+        self.vocabulary = {}
+        self.id2word = []
+        # Frequencies of words and trigrams over all articles
+        self.words = new_counter()
+        self.n_gramms = new_counter()
+        self._packed = True
+        # Last two words (or their ids) of the previous articles
+        self._tail = [] if approximate else array('I')
+
+        self.add_articles(articles)
+
+    def add_articles(self, articles):
+        # Articles are consumed one at a time, only the counters are kept
+        for article in articles:
+            words = [word for word in re.findall(r'\w+', article) if word not in self.stop_words]
+            if self.approximate:
+                words, n_gramms = self._count_words(words)
+            else:
+                words, n_gramms = self._count_ids(words)
+
+            self.articles_count += 1
+            self.words.update(words)
+            self.n_gramms.update(n_gramms)
+
+    def _count_words(self, words):
+        # Returns counts of the words and of the trigrams as strings
+        tokens = self._tail + words
+        n_gramms = [' '.join(tokens[i:i + 3]) for i in range(len(tokens) - 2)]
+        self._tail = tokens[-2:]
+        return Counter(words), Counter(n_gramms)
+
+    def _count_ids(self, words):
+        # Returns counts of the word ids and of the trigrams
+        ids = self._tail + self._get_ids(words)
+        tokens = np.frombuffer(ids, dtype=np.uint32).astype(np.uint64)
+
+        words, words_counts = np.unique(tokens[len(self._tail):], return_counts=True)
+        self._tail = ids[-2:]
+        return dict(zip(words.tolist(), words_counts.tolist())), self._count_3grams(tokens)
+
+    def _count_3grams(self, tokens):
+        # Returns counts of the packed trigrams, or of triples of ids
+        # when the ids do not fit into id_bits
+        if len(self.id2word) <= 1 << self.id_bits:
+            n_gramms, counts = np.unique(self._get_3grams(tokens), return_counts=True)
+            return dict(zip(n_gramms.tolist(), counts.tolist()))
+
+        self._unpack_3grams()
+        rows = np.column_stack((tokens[:-2], tokens[1:-1], tokens[2:]))
+        if not len(rows):
+            return {}
+        n_gramms, counts = np.unique(rows, axis=0, return_counts=True)
+        return dict(zip(map(tuple, n_gramms.tolist()), counts.tolist()))
+
+    def _unpack_3grams(self):
+        # Trigrams counted so far are converted to triples of ids once
+        if self._packed:
+            self.n_gramms = Counter({self._unpack_3gram(n_gramm): count for n_gramm, count in self.n_gramms.items()})
+            self._packed = False
+
+    def _get_ids(self, words):
+        ids = array('I')
+
+        for word in words:
+            if word not in self.vocabulary:
+                self.vocabulary[word] = len(self.id2word)
+                self.id2word.append(word)
+            ids.append(self.vocabulary[word])
+
+        return ids
+
+    def _get_3grams(self, tokens):
+        # Packs every three consecutive word ids into one 64-bit integer
+        bits = np.uint64(self.id_bits)
+        return (tokens[:-2] << bits << bits) | (tokens[1:-1] << bits) | tokens[2:]
+
+    def _unpack_3gram(self, n_gramm):
+        mask = (1 << self.id_bits) - 1
+        return n_gramm >> 2 * self.id_bits, n_gramm >> self.id_bits & mask, n_gramm & mask
+
+    def _decode_3gram(self, n_gramm):
+        if not isinstance(n_gramm, tuple):
+            n_gramm = self._unpack_3gram(n_gramm)
+        return ' '.join(self.id2word[i] for i in n_gramm)
 
     def _tuple_from_counter(self, counter):
         return [tuple(i[0] for i in counter), tuple(i[1] for i in counter)]
 
     def get_top_3grams(self, n=None):
-        n_gramms = []
-
-        for index in range(2, len(self.words)):
-            first = self.words[index-2]
-            second = self.words[index-1]
-            third = self.words[index]
-            n_gramms.append('%s %s %s' % (first, second, third))
-
-        return self._tuple_from_counter(Counter(n_gramms).most_common(n))
+        top = self.n_gramms.most_common(n)
+        if not self.approximate:
+            top = [(self._decode_3gram(n_gramm), freq) for n_gramm, freq in top]
+        return self._tuple_from_counter(top)
 
 
     def get_top_words(self, n=None):
-        return self._tuple_from_counter(Counter(self.words).most_common(n))
+        top = self.words.most_common(n)
+        if not self.approximate:
+            top = [(self.id2word[word], freq) for word, freq in top]
+        return self._tuple_from_counter(top)
 
 
 class Experiment:
@@ -0,0 +1,113 @@
+#-*- coding: utf-8 -*-
+import random
+import unittest
+from collections import Counter
+
+from experiment import CountMinSketch, HeavyHitters, TextStatistics
+
+
+def zipf_words(count, seed=0):
+    # Words with Zipf-like frequencies, as in natural texts
+    generator = random.Random(seed)
+    return ['w%d' % int(generator.paretovariate(1.1)) for _ in range(count)]
+
+
+def recall(items, exact_items):
+    # Share of the exact top items found in the approximate top
+    return len(set(items) & set(exact_items)) / float(len(exact_items))
+
+
+class TestCountMinSketch(unittest.TestCase):
+    def test_estimates_are_within_bound(self):
+        sketch = CountMinSketch(epsilon=0.01, delta=0.01)
+        counts = Counter(zipf_words(20000))
+        for word, count in counts.items():
+            sketch.add(word, count)
+
+        total = sum(counts.values())
+        errors = [sketch.estimate(word) - count for word, count in counts.items()]
+        # Estimates never go below the true counts
+        self.assertGreaterEqual(min(errors), 0)
+        # and exceed them by more than epsilon * N with probability delta
+        self.assertLessEqual(sum(error > 0.01 * total for error in errors), 0.01 * len(counts))
+
+    def test_estimates_do_not_depend_on_hash_seed(self):
+        # Cells come from md5 of the item, not from hash()
+        self.assertEqual(CountMinSketch()._cells('word'), CountMinSketch()._cells(u'word'))
+        self.assertEqual(CountMinSketch._key('word'), 0xc47d187067c6cf9)
+
+    def test_add_returns_estimate(self):
+        sketch = CountMinSketch()
+        sketch.add('a', 3)
+        self.assertEqual(sketch.add('a'), 4)
+        self.assertEqual(sketch.estimate('a'), 4)
+
+
+class TestHeavyHitters(unittest.TestCase):
+    def test_least_counted_item_is_evicted(self):
+        counter = HeavyHitters(capacity=2)
+        counter.update({'a': 3, 'b': 1})
+        counter.update(['c', 'c'])
+        self.assertEqual(counter.most_common(), [('a', 3), ('c', 2)])
+
+        # An item counted less than the remembered ones is not added
+        counter.update(['d'])
+        self.assertEqual(counter.most_common(), [('a', 3), ('c', 2)])
+
+    def test_most_common_zero(self):
+        counter = HeavyHitters()
+        counter.update(['a', 'b', 'a'])
+        self.assertEqual(counter.most_common(0), [])
+        self.assertEqual(counter.most_common(), [('a', 2), ('b', 1)])
+
+    def test_zero_capacity(self):
+        counter = HeavyHitters(capacity=0)
+        counter.update(['a', 'b', 'a'])
+        self.assertEqual(counter.most_common(), [])
+        self.assertEqual(counter.sketch.estimate('a'), 2)
+
+    def test_top_is_close_to_exact_on_skewed_data(self):
+        words = zipf_words(50000)
+        counter = HeavyHitters(capacity=50, epsilon=0.001)
+        counter.update(words)
+        exact = Counter(words)
+
+        top = counter.most_common(10)
+        for word, estimate in top:
+            self.assertTrue(0 <= estimate - exact[word] <= 0.001 * len(words))
+        self.assertGreaterEqual(recall([word for word, _ in top], [word for word, _ in exact.most_common(10)]), 0.9)
+
+
+class TestTextStatistics(unittest.TestCase):
+    def test_approximate_top_is_close_to_exact(self):
+        words = zipf_words(30000)
+        articles = [' '.join(words[start:start + 1000]) for start in range(0, len(words), 1000)]
+        exact = TextStatistics(articles)
+        approximate = TextStatistics(articles, approximate=True, capacity=100, epsilon=0.001)
+
+        for get_top in ('get_top_words', 'get_top_3grams'):
+            exact_counts = dict(zip(*getattr(exact, get_top)()))
+            top = list(zip(*getattr(approximate, get_top)(10)))
+            for item, estimate in top:
+                self.assertTrue(0 <= estimate - exact_counts[item] <= 0.001 * len(words))
+            self.assertGreaterEqual(recall([item for item, _ in top], getattr(exact, get_top)(10)[0]), 0.8)
+        self.assertEqual(approximate.vocabulary, {})
+
+    def test_vocabulary_larger_than_packed_ids(self):
+        words = zipf_words(3000)
+        articles = ['w1 w2 w1 w2 w1', 'w2 w1 w3'] + [' '.join(words[start:start + 100])
+                                                  for start in range(0, len(words), 100)] + ['w1 w2']
+        exact = TextStatistics(articles)
+        # Packed trigrams of the first articles are converted to triples
+        # of ids after the 8th word
+        unpacked = TextStatistics()
+        unpacked.id_bits = 3
+        unpacked.add_articles(articles)
+
+        self.assertFalse(unpacked._packed)
+        self.assertEqual(dict(zip(*unpacked.get_top_3grams())), dict(zip(*exact.get_top_3grams())))
+        self.assertEqual(dict(zip(*unpacked.get_top_words())), dict(zip(*exact.get_top_words())))
+
+
+if __name__ == '__main__':
+    unittest.main()
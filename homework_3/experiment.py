@@ -1,68 +1,757 @@
 #-*- coding: utf-8 -*-
 from __future__ import division
+import os
 import re
+import bz2
 import math
-from collections import Counter
+import time
+import json
+import zlib
+import heapq
+import sqlite3
+import hashlib
+import socket
+import urllib
+import httplib
+import urlparse
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from array import array
+from collections import Counter, deque
+from itertools import islice, imap
+from operator import itemgetter
+from xml.etree import ElementTree
+
+import numpy as np
 
 from pattern.web import Wikipedia
 from pattern.web import plaintext
 
 
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'articles.sqlite')
+# Path to a local dump, for example enwiki-latest-pages-articles-multistream.xml.bz2,
+# the articles are read from it instead of Wikipedia
+DUMP_PATH = os.environ.get('WIKI_DUMP')
+
+
+class WikiArticle:
+    def __init__(self, title, html):
+        self.title = title
+        self.html = html
+        self.links = []
+
+        # Links to other articles, except pages of other namespaces
+        for link in re.findall(r'href="(?:https?:)?(?://[^/"]+)?/wiki/([^"#?]+)[^"]*"', html):
+            link = urllib.unquote(link.encode('utf-8') if isinstance(link, unicode) else link)
+            link = link.decode('utf-8').replace('_', ' ')
+            if ':' not in link and link not in self.links:
+                self.links.append(link)
+
+    def plaintext(self):
+        return plaintext(self.html)
+
+
+class WikiClient:
+    """Wikipedia client which reuses HTTP connections
+
+    Articles are downloaded as rendered HTML from `url`, every thread
+    keeps its own keep-alive connection to the host. `rate` is the
+    maximum number of requests per second to the host, shared by all
+    threads.
+    """
+
+    def __init__(self, url='https://en.wikipedia.org', rate=None, timeout=30):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.rate = rate
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next_request = 0
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            if self.scheme == 'https':
+                connection = httplib.HTTPSConnection(self.host, timeout=self.timeout)
+            else:
+                connection = httplib.HTTPConnection(self.host, timeout=self.timeout)
+            self._local.connection = connection
+
+        return connection
+
+    def _wait(self):
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = time.time()
+            delay = self._next_request - now
+            self._next_request = max(now, self._next_request) + 1.0 / self.rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def _get(self, path):
+        # The server may close an idle connection, then it is opened again
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                connection.request('GET', path, headers={'User-Agent': 'homework-wiki-parser'})
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        """Closes the connection of the current thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def article(self, title):
+        """Returns the article `title` or None if there is no such article"""
+        self._wait()
+
+        query = urllib.urlencode({'title': title.encode('utf-8'), 'action': 'render'})
+        status, html = self._get('/w/index.php?' + query)
+
+        if status != 200:
+            return None
+        return WikiArticle(title, html.decode('utf-8'))
+
+
+class WikiDumpArticle:
+    def __init__(self, title, links, text):
+        self.title = title
+        self.links = links
+        self.text = text
+
+    def plaintext(self):
+        text = self.text
+        # Templates and tables may be nested, remove them from inside out
+        for pattern in (r'\{\{[^{}]*\}\}', r'\{\|(?:(?!\{\|)[\s\S])*?\|\}'):
+            text, count = re.subn(pattern, '', text)
+            while count:
+                text, count = re.subn(pattern, '', text)
+
+        text = re.sub(r'<!--[\s\S]*?-->|<ref[^>/]*/>|<ref[^>]*>[\s\S]*?</ref>', '', text)
+        text = re.sub(r'\[\[[^\]|]*:[^\]]*\]\]', '', text)
+        text = re.sub(r'\[\[(?:[^\]|]*\|)?([^\]]*)\]\]', r'\1', text)
+        text = re.sub(r'\[https?://\S+ ?([^\]]*)\]', r'\1', text)
+        text = re.sub(r"'{2,}|<[^>]+>|^=+ *| *=+$", '', text, flags=re.M)
+        return text
+
+
+class WikiDump:
+    """Articles of a local Wikipedia XML dump compressed with bzip2
+
+    On the first call the dump is read once, page by page, and an
+    index is built with the links of every article and its position:
+    the offset of the bzip2 stream and the offset in that stream.
+    In multistream dumps (pages-articles-multistream.xml.bz2) every
+    stream holds about a hundred pages, so an article is read by
+    decompressing only its own stream.
+
+    The index is kept in the SQLite file `index_path`, next to the dump
+    by default, so later runs do not read the dump again. It is built
+    anew when the size or the modification time of the dump changes.
+    """
+    # Size of the blocks read from the compressed file
+    block_size = 2 ** 20
+    # Number of pages written to the index at once
+    batch_size = 10000
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + '.index.sqlite'
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _read_streams(self, offset=0):
+        # Yields (stream offset, decompressed data) for every bzip2 stream
+        with open(self.path, 'rb') as dump:
+            dump.seek(offset)
+            decompressor = bz2.BZ2Decompressor()
+            stream = offset
+            position = offset
+
+            for block in iter(lambda: dump.read(self.block_size), b''):
+                while block:
+                    try:
+                        data = decompressor.decompress(block)
+                    except EOFError:
+                        # The stream has ended exactly at the end of the
+                        # previous block, the block starts the next stream
+                        stream = position
+                        decompressor = bz2.BZ2Decompressor()
+                        continue
+
+                    yield stream, data
+                    if not decompressor.unused_data:
+                        position += len(block)
+                        break
+
+                    # The stream has ended inside the block, the rest of
+                    # the block is the beginning of the next stream
+                    unused = decompressor.unused_data
+                    position += len(block) - len(unused)
+                    stream = position
+                    decompressor = bz2.BZ2Decompressor()
+                    block = unused
+
+    def _read_pages(self):
+        # Yields (stream offset, offset in the stream, page xml)
+        current_stream, position, page, start, pending = None, 0, [], None, b''
+
+        for stream, data in self._read_streams():
+            if stream != current_stream:
+                current_stream, position, pending = stream, 0, b''
+
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+
+            for line in lines:
+                line += b'\n'
+                if line.strip() == b'<page>':
+                    start, page = position, []
+                if start is not None:
+                    page.append(line)
+                if line.strip() == b'</page>' and start is not None:
+                    yield current_stream, start, b''.join(page)
+                    start = None
+                position += len(line)
+
+    @staticmethod
+    def _parse_page(xml):
+        page = ElementTree.fromstring(xml)
+        redirect = page.find('redirect')
+        text = page.findtext('revision/text') or u''
+        return (page.findtext('title'), page.findtext('ns'),
+                redirect.get('title') if redirect is not None else None, text)
+
+    @staticmethod
+    def _normalize(title):
+        title = title.replace('_', ' ').strip()
+        return title[:1].upper() + title[1:]
+
+    def _get_links(self, text):
+        links = []
+        for link in re.findall(r'\[\[([^\]|#]+)', text):
+            link = self._normalize(link)
+            if link and ':' not in link and link not in links:
+                links.append(link)
+        return links
+
+    def _open_index(self):
+        connection = sqlite3.connect(self.index_path, check_same_thread=False)
+        connection.execute('CREATE TABLE IF NOT EXISTS dump (size INTEGER, modified REAL)')
+        # Position of every article: stream offset, offset in the stream, length
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS pages (title TEXT PRIMARY KEY, stream INTEGER, '
+            'start INTEGER, length INTEGER, links TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS redirects (title TEXT PRIMARY KEY, target TEXT)')
+
+        stat = os.stat(self.path)
+        if connection.execute('SELECT size, modified FROM dump').fetchone() != (stat.st_size, stat.st_mtime):
+            self._build_index(connection)
+            connection.execute('DELETE FROM dump')
+            connection.execute('INSERT INTO dump VALUES (?, ?)', (stat.st_size, stat.st_mtime))
+        connection.commit()
+        return connection
+
+    def _build_index(self, connection):
+        connection.execute('DELETE FROM pages')
+        connection.execute('DELETE FROM redirects')
+        pages, redirects = [], []
+
+        for stream, start, xml in self._read_pages():
+            title, namespace, redirect, text = self._parse_page(xml)
+            if namespace not in (None, '0'):
+                continue
+
+            if redirect is not None:
+                redirects.append((title, self._normalize(redirect)))
+            else:
+                pages.append((title, stream, start, len(xml), json.dumps(self._get_links(text))))
+
+            if len(pages) + len(redirects) >= self.batch_size:
+                self._write_index(connection, pages, redirects)
+                pages, redirects = [], []
+
+        self._write_index(connection, pages, redirects)
+
+    @staticmethod
+    def _write_index(connection, pages, redirects):
+        connection.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)', pages)
+        connection.executemany('INSERT OR REPLACE INTO redirects VALUES (?, ?)', redirects)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def article(self, title):
+        """Returns the article `title` or None if there is no such article"""
+        title = self._normalize(title)
+
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._open_index()
+
+            redirect = self._connection.execute(
+                'SELECT target FROM redirects WHERE title = ?', (title,)).fetchone()
+            if redirect is not None:
+                title = redirect[0]
+            row = self._connection.execute(
+                'SELECT stream, start, length, links FROM pages WHERE title = ?', (title,)).fetchone()
+
+        if row is None:
+            return None
+
+        stream, start, length, links = row
+        # Only the bytes of the page are kept, the ones before it are dropped
+        page, position, end = [], 0, start + length
+        for current_stream, chunk in self._read_streams(stream):
+            if current_stream != stream:
+                break
+            if position + len(chunk) > start:
+                page.append(chunk[max(start - position, 0): end - position])
+            position += len(chunk)
+            if position >= end:
+                break
+
+        _, _, _, text = self._parse_page(b''.join(page))
+        return WikiDumpArticle(title, json.loads(links), text)
+
+
+class ArticleCache:
+    """Cache of processed articles in an SQLite file
+
+    Every article is stored by the hash of its title as compressed
+    JSON with the processed text and the links. Articles older than
+    `ttl` seconds are downloaded again. When the compressed articles
+    take more than `max_size` bytes, the least recently used ones are
+    removed. The cache may be shared by several threads.
+
+    Access times of read articles are kept in memory and written with
+    the next `put`, after `flush_every` reads or on `close`, so reading
+    from the cache does not write to the disk.
+    """
+    flush_every = 100
+
+    def __init__(self, path, ttl=None, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._accessed = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS articles (key TEXT PRIMARY KEY, data BLOB, '
+            'size INTEGER, created REAL, accessed REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS accessed ON articles (accessed)')
+        self._connection.commit()
+        # Total size of the articles, updated on every change
+        self._size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM articles').fetchone()[0]
+
+    @staticmethod
+    def _key(title):
+        return hashlib.sha1(title.encode('utf-8')).hexdigest()
+
+    def get(self, title):
+        """Returns `(text, links)` of the article or None"""
+        key = self._key(title)
+        now = time.time()
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT data, size, created FROM articles WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+
+            data, size, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._connection.execute('DELETE FROM articles WHERE key = ?', (key,))
+                self._connection.commit()
+                self._accessed.pop(key, None)
+                self._size -= size
+                return None
+
+            self._accessed[key] = now
+            if len(self._accessed) >= self.flush_every:
+                self._flush()
+                self._connection.commit()
+
+        article = json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+        return article['text'], article['links']
+
+    def put(self, title, text, links):
+        data = zlib.compress(json.dumps({'text': text, 'links': links}).encode('utf-8'))
+        key = self._key(title)
+        now = time.time()
+
+        with self._lock:
+            # Older access times must not overwrite the new one
+            self._flush()
+            row = self._connection.execute('SELECT size FROM articles WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._size -= row[0]
+
+            self._connection.execute(
+                'INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?)',
+                (key, sqlite3.Binary(data), len(data), now, now))
+            self._size += len(data)
+            if self.max_size is not None and self._size > self.max_size:
+                self._evict()
+            self._connection.commit()
+
+    def _flush(self):
+        """Writes the access times of read articles, without commit"""
+        if self._accessed:
+            self._connection.executemany('UPDATE articles SET accessed = ? WHERE key = ?',
+                                         [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def _evict(self):
+        rows = self._connection.execute('SELECT key, size FROM articles ORDER BY accessed')
+
+        to_delete = []
+        for key, article_size in rows:
+            if self._size <= self.max_size:
+                break
+            to_delete.append((key,))
+            self._size -= article_size
+
+        self._connection.executemany('DELETE FROM articles WHERE key = ?', to_delete)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Tokenizer:
+    """Splits text into sentences of words in one pass over the text
+
+    A sentence ends with a word followed by one of '.?!;', words of
+    an unfinished sentence before a line break are dropped:
+
+    >>> tokenizer = Tokenizer()
+    >>> list(tokenizer.sentences('One, two. Three!\\nFour five'))
+    [['one', 'two'], ['three']]
+    >>> list(tokenizer.words('one, two. three'))
+    ['one', 'two', 'three']
+    """
+    pattern = re.compile(r'(\w+)([.?!;])?|(\n)')
+    word_pattern = re.compile(r'\w+')
+
+    def sentences(self, text):
+        """Yields sentences of `text` as lists of lowercase words"""
+        sentence = []
+
+        for match in self.pattern.finditer(text):
+            word, end, line_break = match.groups()
+            if line_break:
+                sentence = []
+            else:
+                sentence.append(word.lower())
+                if end:
+                    yield sentence
+                    sentence = []
+
+    def words(self, text):
+        """Yields words of `text` as they are"""
+        for match in self.word_pattern.finditer(text):
+            yield match.group()
+
+
 class WikiParser:
-    def __init__(self):
-        self.wiki = Wikipedia()
+    tokenizer = Tokenizer()
+
+    def __init__(self, wiki=None, concurrency=1, cache=None):
+        # `wiki` is anything with the article(title) method, for example
+        # Wikipedia from pattern.web, WikiClient or WikiDump
+        self.wiki = wiki or Wikipedia()
+        self.concurrency = concurrency
+        # ArticleCache, articles found there are not downloaded
+        self.cache = cache
 
     def get_articles(self, start, depth, max_count=None):
         """Returns all articles starting with `start`
 
         `start` is the initial article. `depth` is the depth of the
         search for articles on cross-references. `max_count` is
-        maximum number of returned articles. Articles are returned
-        as an array of lines, where each line is an article without
-        punctuation marks, except points. For example:
+        maximum number of returned articles. Every article is returned
+        as a list of sentences, where each sentence is a list of
+        lowercase words. For example:
 
         >>> parser = WikiParser()
         >>> title = 'Natural language processing'
         >>> len(parser.get_articles(title, depth=1)) is 1
         True
+
+        Every article is downloaded only once. Articles of one level
+        are downloaded by `concurrency` threads at the same time.
         """
         atricles = []
         housing = [start]
+        visited = set(housing)
         current_depth = 0
 
-        while current_depth < depth:
-            # Links in the current article to other articles
-            cross_references = []
+        pool = ThreadPool(self.concurrency) if self.concurrency > 1 else None
+        fetch = pool.imap if pool else imap
+
+        try:
+            while current_depth < depth and housing:
+                # Only the articles that will be returned are downloaded
+                if max_count is not None:
+                    housing = housing[max(len(housing) - (max_count - len(atricles)), 0):]
 
-            # To extract one article, while in the corpus there are articles
-            while housing:
-                article = self.wiki.article(housing.pop())
-                cross_references.extend(article.links)
+                # Links in the current article to other articles
+                cross_references = []
 
-                # Find all sentence in article
-                sentences = re.findall(r'(.*?\w+[\.\?\!\;])', article.plaintext())
-                # Find all words in each sentence
-                words_in_sentences = [re.findall(r'\w+', sentence) for sentence in sentences]
-                # Join all words in each sentence
-                words = [' '.join(i) + '.' for i in words_in_sentences]
-                # Save the current article as a processed string
-                atricles.append(' '.join(words).lower())
+                # Articles are taken from the end of the housing, as before
+                for article in fetch(self._get_article, reversed(housing)):
+                    if article is None:
+                        continue
 
-            current_depth += 1
-            housing.extend(cross_references)
+                    text, links = article
+                    for link in links:
+                        if link not in visited:
+                            visited.add(link)
+                            cross_references.append(link)
+
+                    atricles.append(text)
+
+                current_depth += 1
+                housing = cross_references
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
 
         return atricles[:max_count]
 
+    def _get_article(self, title):
+        # Returns the processed text and the links of the article
+        # Missing articles are cached too, with None instead of the text
+        if self.cache is not None:
+            article = self.cache.get(title)
+            if article is not None:
+                return article if article[0] is not None else None
+
+        article = self.wiki.article(title)
+        if article is None:
+            text, links = None, []
+        else:
+            text, links = self._process(article), list(article.links)
+
+        if self.cache is not None:
+            self.cache.put(title, text, links)
+
+        return (text, links) if text is not None else None
+
+    def _process(self, article):
+        # Split the article into sentences of words
+        return list(self.tokenizer.sentences(article.plaintext()))
+
+
+def _count_articles(job):
+    """Counts one shard of articles, runs in a worker process"""
+    tail, articles = job
+    statistics = TextStatistics()
+    statistics._tail = tail
+    statistics.add_articles(articles)
+    return statistics
+
 
 class TextStatistics:
-    def __init__(self, articles):
-        self.articles = articles
-        self.articles_in_one_line = ' '.join(self.articles)
-        stop_words = ['the', 'of', 'and', 'a', 'in', 'to', 'is', 'for', 'as',
-            'an', 'this', 'at', 'not', 'which', 'that', 'are', 'on', 'by', 'or',
-            'be', 'with', 's', 'it', 'from']
-        self.words = filter(lambda x: x not in stop_words,
-                            re.findall(r'\w+', self.articles_in_one_line))
+    stop_words = frozenset(['the', 'of', 'and', 'a', 'in', 'to', 'is', 'for',
+        'as', 'an', 'this', 'at', 'not', 'which', 'that', 'are', 'on', 'by',
+        'or', 'be', 'with', 's', 'it', 'from'])
+    tokenizer = Tokenizer()
+    # Number of articles sent to a worker process at once
+    shard_size = 256
+    # Trigrams are packed into one integer by 21 bits per letter code
+    letter_bits = 21
+
+    def __init__(self, articles=(), n_jobs=1):
+        self.n_jobs = n_jobs
+        self.articles_count = 0
+        # Words are counted by integer ids and decoded only for the top
+        self.vocabulary = {}
+        self.id2word = []
+        # Frequencies of word ids and trigrams over all articles
+        self.words = Counter()
+        self.n_gramms = Counter()
+        # Number of articles containing each word and trigram
+        self.words_df = Counter()
+        self.n_gramms_df = Counter()
+        # Last two letters of the previous articles
+        self._tail = ''
+
+        self.add_articles(articles)
+
+    def add_articles(self, articles, n_jobs=None):
+        """Adds new articles to the statistics
+
+        `articles` is any iterable of lines or of articles returned by
+        WikiParser, for example a generator. Articles are consumed one
+        at a time and only the counters are kept, so the old articles
+        are never scanned again:
+
+        >>> experiment = TextStatistics(['this and article of.'])
+        >>> experiment.add_articles(iter(['processing of language.']))
+        >>> experiment.get_top_words(3)
+        [('article', 'processing', 'language'), (1, 1, 1)]
+
+        `n_jobs` is the number of worker processes, by default the one
+        given to the constructor. Workers count shards of articles and
+        their counters are merged, the result is the same as with one
+        process.
+        """
+        n_jobs = n_jobs or self.n_jobs
+        if n_jobs > 1:
+            return self._add_articles_parallel(articles, n_jobs)
+
+        for article in articles:
+            words = self._get_words(article)
+            ids = np.frombuffer(self._get_ids(words), dtype=np.uint32)
+
+            words_ids, words_counts = np.unique(ids, return_counts=True)
+            n_gramms, n_gramms_counts = np.unique(self._get_3grams(words), return_counts=True)
+            # The alphabet is small, so unique trigrams are kept as strings
+            n_gramms = [self._decode_3gram(n_gramm) for n_gramm in n_gramms.tolist()]
+
+            self.articles_count += 1
+            self.words.update(dict(zip(words_ids.tolist(), words_counts.tolist())))
+            self.n_gramms.update(dict(zip(n_gramms, n_gramms_counts.tolist())))
+            self.words_df.update(words_ids.tolist())
+            self.n_gramms_df.update(n_gramms)
+            self._tail = self._get_tail(self._tail, words)
+
+    def _add_articles_parallel(self, articles, n_jobs):
+        articles = iter(articles)
+        pool = multiprocessing.Pool(n_jobs)
+        # Shards sent to the workers and not merged yet, at most two per
+        # worker, so the articles are read only as fast as they are counted
+        in_flight = deque()
+
+        try:
+            for shard in self._get_shards(articles):
+                in_flight.append(pool.apply_async(_count_articles, (shard,)))
+                if len(in_flight) >= 2 * n_jobs:
+                    self._merge(in_flight.popleft().get())
+
+            while in_flight:
+                self._merge(in_flight.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+
+    def _merge(self, statistics):
+        # Word ids of the worker are translated into ours
+        ids = self._get_ids(statistics.id2word)
+
+        self.articles_count += statistics.articles_count
+        self.words.update(dict((ids[word], freq) for word, freq in statistics.words.items()))
+        self.n_gramms.update(statistics.n_gramms)
+        self.words_df.update(dict((ids[word], freq) for word, freq in statistics.words_df.items()))
+        self.n_gramms_df.update(statistics.n_gramms_df)
+
+    def _get_shards(self, articles):
+        # Every shard gets the tail of the shards before it, so trigrams
+        # on the borders of shards are counted exactly once
+        while True:
+            shard = list(islice(articles, self.shard_size))
+            if not shard:
+                return
+
+            yield self._tail, shard
+
+            words = []
+            for article in reversed(shard):
+                words = self._get_words(article) + words
+                if len(' '.join(words)) >= 2:
+                    break
+            self._tail = self._get_tail(self._tail, words)
+
+    def _get_words(self, article):
+        # An article is a line or a list of sentences from WikiParser
+        if isinstance(article, basestring):
+            words = self.tokenizer.words(article)
+        else:
+            words = (word for sentence in article for word in sentence)
+        return [word for word in words if word not in self.stop_words]
+
+    def _get_ids(self, words):
+        ids = array('I')
+
+        for word in words:
+            if word not in self.vocabulary:
+                self.vocabulary[word] = len(self.id2word)
+                self.id2word.append(word)
+            ids.append(self.vocabulary[word])
+
+        return ids
+
+    @staticmethod
+    def _get_tail(tail, words):
+        if not words:
+            return tail
+        return ' '.join(([tail] if tail else []) + words[-2:])[-2:]
+
+    def _get_3grams(self, words):
+        # Trigrams crossing the border with the previous articles are
+        # counted too, as if all articles were joined into one line
+        letters = ' '.join(words)
+        if self._tail and words:
+            letters = self._tail + ' ' + letters
+
+        if isinstance(letters, bytes):
+            codes = np.frombuffer(letters, dtype=np.uint8).astype(np.uint64)
+        else:
+            codes = np.frombuffer(letters.encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+        first, second, third = codes[:-2], codes[1:-1], codes[2:]
+
+        # Skip n-gramm If there are more than two spaces in a row
+        space = ord(' ')
+        skip = ((first == space) & (second == space)) | ((second == space) & (third == space))
+
+        # Every trigram is packed into one 64-bit integer
+        bits = np.uint64(self.letter_bits)
+        return ((first << bits << bits) | (second << bits) | third)[~skip]
+
+    def _decode_3gram(self, n_gramm):
+        mask = (1 << self.letter_bits) - 1
+        codes = [n_gramm >> 2 * self.letter_bits, n_gramm >> self.letter_bits & mask, n_gramm & mask]
+        return ''.join(chr(code) if code < 128 else unichr(code) for code in codes)
+
+    def _idf(self, frequency):
+        return math.log(self.articles_count / frequency, 10)
+
+    def _most_common_by_tf_idf(self, counter, documents_frequency, n=None):
+        # Every IDF is one lookup in the index of document frequencies,
+        # so ranking costs O(V log n) for a vocabulary of V terms
+        tf_idf = ((term, freq * self._idf(documents_frequency[term]))
+                  for term, freq in counter.items())
+
+        if n is None:
+            return sorted(tf_idf, key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, tf_idf, key=itemgetter(1))
 
     def _tuple_from_counter(self, counter):
         return [tuple(i[0] for i in counter), tuple(i[1] for i in counter)]
@@ -71,8 +760,9 @@ class TextStatistics:
         """Returns the most frequent trigrams from all articles
 
         `n` is the number of the most frequent trigrams that must be
-        returned. `use_idf` is the flag at which the frequency is
-        calculated as an IDF parameter.
+        returned. `use_idf` is the flag at which trigrams are ranked by
+        TF-IDF, where IDF is taken from the number of articles
+        containing the trigram.
 
         >>> articles = ['this and article of.', 'processing of language.']
         >>> experiment = TextStatistics(articles)
@@ -81,39 +771,20 @@ class TextStatistics:
         >>> experiment.get_top_3grams(n=3, use_idf=True)
         [('le ', 'ang', 'art'), (0.30102999566398114, 0.30102999566398114, 0.30102999566398114)]
         """
-        n_gramms = []
-
-        # Split all words by letters
-        letters = list(' '.join(self.words))
+        if use_idf:
+            top = self._most_common_by_tf_idf(self.n_gramms, self.n_gramms_df, n)
+        else:
+            top = self.n_gramms.most_common(n)
 
-        for i in range(2, len(letters)):
-            first, second, third = letters[i-2], letters[i-1], letters[i]
-
-            # Skip n-gramm If there are more than two spaces in a row
-            if (first == second == ' ') or (second == third == ' '):
-                continue
-
-            n_gramms.append(''.join([first, second, third]))
-
-        # Get top n-gramms
-        top_n_gramms = Counter(n_gramms).most_common(n)
-
-        if not use_idf:
-            return self._tuple_from_counter(top_n_gramms)
-
-        top_n_gramms_with_idf = []
-        for n_gramm, freq in top_n_gramms:
-            idf = math.log(len(self.articles) / self.articles_in_one_line.count(n_gramm), 10)
-            top_n_gramms_with_idf.append((n_gramm, idf))
-        
-        return self._tuple_from_counter(top_n_gramms_with_idf)
+        return self._tuple_from_counter(top)
 
     def get_top_words(self, n=None, use_idf=False):
         """Returns the most frequent words from all articles
 
         `n` is the number of the most frequent words that must be
-        returned. `use_idf` is the flag at which the frequency is
-        calculated as an IDF parameter.
+        returned. `use_idf` is the flag at which words are ranked by
+        TF-IDF, where IDF is taken from the number of articles
+        containing the word.
 
         >>> articles = ['this and article of and.', 'processing of language of.']
         >>> experiment = TextStatistics(articles)
@@ -122,86 +793,46 @@ class TextStatistics:
         >>> experiment.get_top_words(3, use_idf=True)
         [('article', 'processing', 'language'), (0.30102999566398114, 0.30102999566398114, 0.30102999566398114)]
         """
+        if use_idf:
+            top = self._most_common_by_tf_idf(self.words, self.words_df, n)
+        else:
+            top = self.words.most_common(n)
 
-        top_words = Counter(self.words).most_common(n)
-
-        if not use_idf:
-            return self._tuple_from_counter(top_words)
-
-        top_words_with_idf = []
-        for n_gramm, freq in top_words:
-            idf = math.log(self.articles_in_one_line.count('.') /
-                           self.articles_in_one_line.count(n_gramm), 10)
-            top_words_with_idf.append((n_gramm, idf))
-
-        return self._tuple_from_counter(top_words_with_idf)
+        return self._tuple_from_counter([(self.id2word[word], freq) for word, freq in top])
 
 
 class Experiment:
     @staticmethod
     def show_results():
-        """
-        Top 20 words by housing:
-            language - 1.00883192489
-            can - 1.2218728848
-            was - 1.43634278818
-            retrieved - 1.46547698624
-            such - 1.48163363481
-            have - 1.47482850526
-            speech - 1.48715557166
-            words - 1.48410982165
-            english - 1.51557347295
-            word - 1.16023816799
-            used - 1.48632279195
-            languages - 1.52486835928
-            has - 1.45761860871
-            p - -0.177891577044
-            other - 1.41113487303
-            also - 1.56985203602
-            1 - 0.385151817281
-            may - 1.58734276818
-            one - 1.17542204226
-            text - 1.39985386262
-        Top 20 n-gramms by housing:
-            ed  - -2.05487107024
-            ion - -2.05303666632
-            ing - -2.03471126614
-            tio - -1.99775191021
-            es  - -1.92889100939
-            ng  - -1.9593006881
-            on  - -1.99334037033
-             co - -1.93647003109
-            er  - -1.89033595476
-            ati - -1.90282437247
-            al  - -1.8836922876
-            ent - -1.84174701184
-             re - -1.82695461841
-             in - -2.11257950376
-             pr - -1.74275927529
-            the - -2.34078886142
-            ter - -1.70631880647
-             ma - -1.67609691457
-             th - -2.39386120557
-            ly  - -1.63423624499
+        """Prints the top 20 words and trigrams of the housing by TF-IDF
+
+        The housing is every article within two links of 'Natural
+        language processing'. A term scores its frequency in the
+        housing times log10(N / df), where df is the number of the N
+        articles containing it, so terms found in every article score 0.
         """
         title = 'Natural language processing'
 
-        article = WikiParser().get_articles(title, depth=2)
-        staticstics = TextStatistics(article)
+        # Articles of the first level are taken from the cache later
+        wiki = WikiDump(DUMP_PATH) if DUMP_PATH else None
+        with ArticleCache(CACHE_PATH, ttl=7 * 24 * 60 * 60) as cache:
+            parser = WikiParser(wiki, cache=cache)
 
-        print 'Top 20 words by housing:'
-        top = staticstics.get_top_words(20, use_idf=True)
-        for word, freq in zip(top[0], top[1]):
-            print '  %s - %s' % (word, freq)
+            article = parser.get_articles(title, depth=2)
+            staticstics = TextStatistics(article)
 
-        print 'Top 20 n-gramms by housing:'
-        top = staticstics.get_top_3grams(20, use_idf=True)
-        for n_gramm, freq in zip(top[0], top[1]):
-            print '  %s - %s' % (n_gramm, freq)
+            print 'Top 20 words by housing:'
+            top = staticstics.get_top_words(20, use_idf=True)
+            for word, freq in zip(top[0], top[1]):
+                print '  %s - %s' % (word, freq)
 
-        article = WikiParser().get_articles(title, depth=1)
-        staticstics = TextStatistics(article)
+            print 'Top 20 n-gramms by housing:'
+            top = staticstics.get_top_3grams(20, use_idf=True)
+            for n_gramm, freq in zip(top[0], top[1]):
+                print '  %s - %s' % (n_gramm, freq)
 
+            article = parser.get_articles(title, depth=1)
+            staticstics = TextStatistics(article)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,53 @@
 #-*- coding: utf-8 -*-
+import os
+import bz2
+import math
+import time
+import shutil
+import tempfile
+import urlparse
 import unittest
+import threading
+import BaseHTTPServer
+import SocketServer
 
-from experiment import TextStatistics
+from experiment import ArticleCache, TextStatistics, WikiClient, WikiDump, WikiParser
+
+
+PAGES = {
+    'A': '<p>Alpha text.</p><a href="/wiki/B">b</a> <a href="/wiki/C">c</a>',
+    'B': '<p>Beta text.</p><a href="/wiki/A">a</a> <a href="/wiki/C#History">c</a>',
+    'C': '<p>Gamma text.</p><a href="/wiki/File:C.png">file</a> <a href="/wiki/D">d</a>',
+}
+
+
+class StubWikipediaHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections are closed, so the test does not hang
+    timeout = 1
+
+    def do_GET(self):
+        title = urlparse.parse_qs(urlparse.urlsplit(self.path).query)['title'][0]
+        self.server.requests.append(title)
+        self.server.connections.add(self.client_address)
+
+        body = PAGES.get(title, '')
+        self.send_response(200 if body else 404)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubWikipediaServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubWikipediaHandler)
+        self.requests = []
+        self.connections = set()
 
 
 class TestTextStatistics(unittest.TestCase):
@@ -33,6 +79,255 @@ class TestTextStatistics(unittest.TestCase):
             [('article', 'processing', 'language'), (0.30102999566398114, 0.30102999566398114, 0.30102999566398114)]
         )
 
+    def test_add_articles_is_same_as_all_at_once(self):
+        experiment = TextStatistics()
+        experiment.add_articles(iter(['this and article of.']))
+        experiment.add_articles(iter(['processing of language.']))
+        self.assertEqual(experiment.get_top_3grams(), self.experiment.get_top_3grams())
+        self.assertEqual(experiment.get_top_words(use_idf=True), self.experiment.get_top_words(use_idf=True))
+
+    def test_get_top_words_ranked_by_tf_idf(self):
+        experiment = TextStatistics(['word common word.', 'common rare.', 'common.'])
+        self.assertEqual(
+            experiment.get_top_words(2, use_idf=True),
+            [('word', 'rare'), (2 * math.log(3, 10), math.log(3, 10))]
+        )
+
+    def test_tokenized_articles_are_same_as_lines(self):
+        articles = [[['this', 'and', 'article', 'of']], [['processing', 'of', 'language']]]
+        experiment = TextStatistics(articles)
+        self.assertEqual(experiment.get_top_words(), self.experiment.get_top_words())
+        self.assertEqual(experiment.get_top_3grams(), self.experiment.get_top_3grams())
+
+    def test_parallel_counting_is_same_as_sequential(self):
+        articles = ['this and article of.', 'processing of language.', 'a', 'b c.', 'language.'] * 3
+        sequential = TextStatistics(articles)
+        parallel = TextStatistics()
+        parallel.shard_size = 2
+        parallel.add_articles(iter(articles), n_jobs=2)
+        # Terms with equal scores may come in a different order
+        self.assertEqual(dict(zip(*parallel.get_top_3grams(use_idf=True))),
+                         dict(zip(*sequential.get_top_3grams(use_idf=True))))
+        self.assertEqual(dict(zip(*parallel.get_top_words(use_idf=True))),
+                         dict(zip(*sequential.get_top_words(use_idf=True))))
+
+    def test_parallel_counting_reads_articles_lazily(self):
+        statistics = TextStatistics()
+        statistics.shard_size = 2
+
+        read_ahead = []
+
+        def articles():
+            for index in range(100):
+                read_ahead.append(index - statistics.articles_count)
+                yield 'article number %d.' % index
+
+        statistics.add_articles(articles(), n_jobs=2)
+        self.assertEqual(statistics.articles_count, 100)
+        # At most two shards per worker and the one being built are read
+        # ahead of the counted articles
+        self.assertLessEqual(max(read_ahead), 5 * statistics.shard_size)
+
+
+class TestWikiParser(unittest.TestCase):
+    def setUp(self):
+        self.server = StubWikipediaServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = WikiClient('http://127.0.0.1:%d' % self.server.server_port)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_article_links(self):
+        self.assertEqual(self.client.article('C').links, ['D'])
+        self.assertEqual(self.client.article('B').links, ['A', 'C'])
+
+    def test_missing_article(self):
+        self.assertIsNone(self.client.article('D'))
+
+    def test_every_article_is_downloaded_once(self):
+        parser = WikiParser(self.client, concurrency=2)
+        self.assertEqual(parser.get_articles('A', depth=3), [[['alpha', 'text']], [['gamma', 'text']], [['beta', 'text']]])
+        self.assertEqual(sorted(self.server.requests), ['A', 'B', 'C', 'D'])
+
+    def test_connections_are_reused(self):
+        parser = WikiParser(self.client)
+        parser.get_articles('A', depth=3)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_cached_articles_are_not_downloaded(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = ArticleCache(os.path.join(directory, 'articles.sqlite'))
+            parser = WikiParser(self.client, cache=cache)
+            articles = parser.get_articles('A', depth=3)
+
+            self.assertEqual(parser.get_articles('A', depth=3), articles)
+            self.assertEqual(sorted(self.server.requests), ['A', 'B', 'C', 'D'])
+            cache.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_max_count(self):
+        parser = WikiParser(self.client, concurrency=2)
+        self.assertEqual(parser.get_articles('A', depth=3, max_count=2), [[['alpha', 'text']], [['gamma', 'text']]])
+        self.assertEqual(sorted(self.server.requests), ['A', 'C'])
+
+
+class TestArticleCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'articles.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_and_get(self):
+        cache = ArticleCache(self.path)
+        cache.put(u'Caf\xe9', u'text.', [u'A', u'B'])
+        cache.close()
+
+        # The articles are kept on disk between runs
+        self.assertEqual(ArticleCache(self.path).get(u'Caf\xe9'), (u'text.', [u'A', u'B']))
+        self.assertIsNone(ArticleCache(self.path).get(u'Cafe'))
+
+    def test_expired_articles(self):
+        cache = ArticleCache(self.path, ttl=0.01)
+        cache.put('A', 'text.', [])
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('A'))
+
+    def test_least_recently_used_articles_are_evicted(self):
+        cache = ArticleCache(self.path)
+        cache.put('A', 'a' * 100, [])
+        size = os.path.getsize(self.path)
+        cache.max_size = 1
+
+        cache.put('B', 'b' * 100, [])
+        self.assertIsNone(cache.get('A'))
+        self.assertIsNone(cache.get('B'))
+
+        cache.max_size = 10 ** 6
+        for title in 'ABC':
+            cache.put(title, title * 100, [])
+            time.sleep(0.01)
+        cache.get('A')
+        size = cache._connection.execute('SELECT SUM(size) FROM articles').fetchone()[0]
+        cache.max_size = size - 1
+        cache.put('D', 'd' * 100, [])
+
+        self.assertIsNotNone(cache.get('A'))
+        self.assertIsNone(cache.get('B'))
+        self.assertIsNotNone(cache.get('D'))
+
+    def test_reading_does_not_write(self):
+        cache = ArticleCache(self.path, max_size=10 ** 6)
+        for title in 'AB':
+            cache.put(title, title * 100, [])
+        changes = cache._connection.total_changes
+        for _ in range(10):
+            cache.get('A')
+        self.assertEqual(cache._connection.total_changes, changes)
+
+        # The access times are written before the next eviction
+        cache.max_size = cache._size
+        cache.put('C', 'c' * 100, [])
+        self.assertIsNotNone(cache.get('A'))
+        self.assertIsNone(cache.get('B'))
+        self.assertEqual(cache._size, cache._connection.execute('SELECT SUM(size) FROM articles').fetchone()[0])
+
+    def test_access_times_are_written_on_close(self):
+        with ArticleCache(self.path) as cache:
+            cache.put('A', 'text.', [])
+            cache.get('A')
+            accessed = cache._accessed[cache._key('A')]
+
+        cache = ArticleCache(self.path)
+        self.assertEqual(cache._connection.execute('SELECT accessed FROM articles').fetchone()[0], accessed)
+
+
+class TestWikiDump(unittest.TestCase):
+    header = '<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/">\n<siteinfo></siteinfo>\n'
+    pages = [
+        ('A', '0', None, "'''A''' links to [[B|the b]] and [[c]].{{cite|x}}<ref>ref</ref>"),
+        ('B', '0', None, 'B links to [[A#History|A]] and [[File:b.png|thumb]].'),
+        ('C', '0', None, '== C ==\nC links to [[Missing]].'),
+        ('D', '0', 'B', '#REDIRECT [[B]]'),
+        ('Talk:A', '1', None, 'Talk links to [[C]].'),
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _page(self, title, namespace, redirect, text):
+        redirect = '<redirect title="%s" />\n' % redirect if redirect else ''
+        return ('<page>\n<title>%s</title>\n<ns>%s</ns>\n%s<revision>\n<text>%s</text>\n'
+                '</revision>\n</page>\n' % (title, namespace, redirect, text.replace('<', '&lt;')))
+
+    def _write_dump(self, multistream):
+        path = os.path.join(self.directory, 'dump.xml.bz2')
+        pages = [self._page(*page) for page in self.pages]
+        if multistream:
+            # Every page in its own bzip2 stream, as in the multistream dumps
+            streams = [self.header] + pages + ['</mediawiki>\n']
+        else:
+            streams = [self.header + ''.join(pages) + '</mediawiki>\n']
+
+        with open(path, 'wb') as dump:
+            for stream in streams:
+                dump.write(bz2.compress(stream))
+        return path
+
+    def test_articles(self):
+        for multistream in (False, True):
+            dump = WikiDump(self._write_dump(multistream))
+            article = dump.article('A')
+            self.assertEqual(article.links, ['B', 'C'])
+            self.assertEqual(article.plaintext(), 'A links to the b and c.')
+            self.assertEqual(dump.article('B').plaintext(), 'B links to A and .')
+            self.assertEqual(dump.article('C').plaintext(), 'C\nC links to Missing.')
+            self.assertEqual(dump.article('D').title, 'B')
+            self.assertIsNone(dump.article('Talk:A'))
+            self.assertIsNone(dump.article('Missing'))
+
+    def test_stream_ends_at_block_boundary(self):
+        path = self._write_dump(multistream=True)
+        for block_size in (len(bz2.compress(self.header)), 1, 7):
+            # Every block size builds its own index
+            dump = WikiDump(path, index_path=os.path.join(self.directory, 'index%d.sqlite' % block_size))
+            dump.block_size = block_size
+            self.assertEqual(dump.article('A').links, ['B', 'C'])
+            self.assertEqual(dump.article('C').plaintext(), 'C\nC links to Missing.')
+
+    def test_index_is_saved(self):
+        path = self._write_dump(multistream=True)
+        WikiDump(path).article('A')
+
+        # The dump is not read again for the index
+        dump = WikiDump(path)
+        dump._read_pages = None
+        self.assertEqual(dump.article('D').links, ['A'])
+        dump.close()
+
+        # but is when it changes
+        self.pages.append(('E', '0', None, 'E links to [[A]].'))
+        try:
+            self._write_dump(multistream=False)
+        finally:
+            self.pages.pop()
+        self.assertEqual(WikiDump(path).article('E').links, ['A'])
+
+    def test_parser(self):
+        parser = WikiParser(WikiDump(self._write_dump(multistream=True)))
+        self.assertEqual(len(parser.get_articles('A', depth=2)), 3)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,190 @@
+#-*- coding: utf-8 -*-
+"""Throughput and hash-collision benchmark of the search engines
+
+Texts and patterns are generated from a fixed seed, which also fixes
+the random hash parameters of `rabin`, so two runs of the same
+configuration are comparable. For example:
+
+    python benchmark.py --output bench.json
+
+Every result row holds the speed in MB/s, the number of hash hits
+that had to be rejected by the string comparison (`null` for the
+naive and Aho-Corasick engines, which do not hash) and the peak memory
+of the search. Collisions that are not counted by the search itself
+are counted after the timed run.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import rabin
+
+
+def generate_text(rng, alphabet, length):
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def generate_patterns(rng, text, alphabet, count, min_length=4, max_length=12):
+    """Half of the patterns are cut from the text, half are random"""
+    patterns = []
+
+    for index in range(count):
+        length = rng.randint(min_length, max_length)
+        if index % 2 == 0:
+            start = rng.randint(0, len(text) - length)
+            patterns.append(text[start: start + length])
+        else:
+            patterns.append(generate_text(rng, alphabet, length))
+
+    return patterns
+
+
+def run_naive(text, patterns):
+    return sum(len(rabin.search_rabin_naive(text, pattern)) for pattern in patterns), None
+
+
+def run_multi(text, patterns):
+    table = rabin.PatternTable(patterns)
+    return sum(1 for _ in table.scan(text)), table.collisions
+
+
+def run_aho_corasick(text, patterns):
+    return sum(len(indices) for indices in rabin.search_aho_corasick(text, patterns)), None
+
+
+def run_stream(text, patterns):
+    chunks = io.StringIO(text)
+    table = rabin.PatternTable(patterns)
+    return sum(1 for _ in rabin.search_rabin_stream(chunks, patterns, table=table)), table.collisions
+
+
+def count_vectorized_hits(text, patterns):
+    """Every window whose hash equals a pattern hash was compared as a string"""
+    hits = 0
+    pattern_hashes = rabin.VectorizedHash.batch(patterns)
+    for size in set(len(pattern) for pattern in patterns):
+        hashes = pattern_hashes[[len(pattern) == size for pattern in patterns]]
+        window_hashes = rabin.VectorizedHash.windows(text, size)
+        for hash, count in zip(*np.unique(hashes, return_counts=True)):
+            hits += int(count) * int(np.count_nonzero(window_hashes == hash))
+
+    return hits
+
+
+def run_vectorized(text, patterns):
+    matches = sum(len(indices) for indices in rabin.search_rabin_vectorized(text, patterns))
+    # The hits are recounted outside of the timed search
+    return matches, lambda: count_vectorized_hits(text, patterns) - matches
+
+
+def run_file(text, patterns):
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        file.write(text.encode('ascii'))
+
+    try:
+        indices, collisions = rabin.search_file(file.name, [pattern.encode('ascii') for pattern in patterns],
+                                                return_collisions=True)
+        return sum(len(found) for found in indices), collisions
+    finally:
+        os.remove(file.name)
+
+
+ENGINES = {
+    'naive': run_naive,
+    'multi': run_multi,
+    'aho_corasick': run_aho_corasick,
+    'stream': run_stream,
+    'vectorized': run_vectorized,
+    'file': run_file,
+}
+
+
+def measure(engine, text, patterns):
+    start = time.perf_counter()
+    matches, false_positives = ENGINES[engine](text, patterns)
+    seconds = time.perf_counter() - start
+
+    if callable(false_positives):
+        false_positives = false_positives()
+
+    # Tracing slows the search down, so the memory is measured separately
+    tracemalloc.start()
+    ENGINES[engine](text, patterns)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'engine': engine,
+        'seconds': seconds,
+        'mb_per_second': len(text) / 2 ** 20 / seconds if seconds else None,
+        'matches': matches,
+        'false_positives': false_positives,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run(seed, alphabet_sizes, text_lengths, pattern_counts, engines):
+    rng = random.Random(seed)
+
+    # The hash parameters are chosen at import time, fix them as well
+    rabin.PolynomialHash.q = rng.choice(rabin.PolynomialHash._prime_numbers)
+    rabin.PolynomialHash.x = rng.randint(0, rabin.PolynomialHash.q - 1)
+    rabin.RollingHash.x = rng.randint(2 ** 16, rabin.RollingHash.q - 1)
+    rabin.VectorizedHash.x = rng.randint(2 ** 16, rabin.VectorizedHash.q - 1)
+
+    results = []
+    for alphabet_size in alphabet_sizes:
+        alphabet = 'abcdefghijklmnopqrstuvwxyz'[:alphabet_size]
+
+        for text_length in text_lengths:
+            text = generate_text(rng, alphabet, text_length)
+
+            for pattern_count in pattern_counts:
+                patterns = generate_patterns(rng, text, alphabet, pattern_count)
+
+                for engine in engines:
+                    result = measure(engine, text, patterns)
+                    result.update(alphabet_size=alphabet_size, text_length=text_length,
+                                  pattern_count=pattern_count)
+                    results.append(result)
+                    print('%(engine)15s  alphabet=%(alphabet_size)-3d text=%(text_length)-9d '
+                          'patterns=%(pattern_count)-5d %(seconds)9.4f s  '
+                          'false positives: %(false_positives)s' % result)
+
+    return {
+        'seed': seed,
+        'hash_parameters': {
+            'polynomial': [rabin.PolynomialHash.q, rabin.PolynomialHash.x],
+            'rolling': [rabin.RollingHash.q, rabin.RollingHash.x],
+            'vectorized': [rabin.VectorizedHash.q, rabin.VectorizedHash.x],
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seed', type=int, default=17)
+    parser.add_argument('--alphabet-sizes', type=int, nargs='+', default=[2, 4, 26])
+    parser.add_argument('--text-lengths', type=int, nargs='+', default=[10 ** 4, 10 ** 5])
+    parser.add_argument('--pattern-counts', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=sorted(ENGINES))
+    parser.add_argument('--output', default='bench_output.json')
+    arguments = parser.parse_args()
+
+    report = run(arguments.seed, arguments.alphabet_sizes, arguments.text_lengths,
+                 arguments.pattern_counts, arguments.engines)
+
+    with open(arguments.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,14 @@
 #-*- coding: utf-8 -*-
+import mmap
+import multiprocessing
+import os
 import random
 
+import numpy as np
+from collections import deque
+from itertools import count, islice
+from operator import itemgetter
+
 """
 Оценка сложности:
     O(|T|+ n1|P1| + n2|P2| ... +ni|Pi|)
@@ -12,6 +20,18 @@ ni - кол-во вхождений паттерна Pi
 """
 
 
+def _codes(text, start=0, stop=None):
+    """Iterates over the letter codes of `text[start:stop]`
+
+    `text` is a string or any bytes-like object (bytes, mmap), the
+    latter is read through a `memoryview` without copying.
+    """
+    if isinstance(text, str):
+        # A generator, not map: on Python 2 map reads the whole text at once
+        return (ord(letter) for letter in islice(text, start, stop))
+    return iter(memoryview(text)[start:stop])
+
+
 class PolynomialHash:
     _prime_numbers = [
            2,   31,   73,  127,  179,  233,  283,  353,  419,  467,
@@ -43,6 +63,196 @@ class PolynomialHash:
         return hash
 
 
+class RollingHash:
+    """Rabin-Karp rolling hash modulo the Mersenne prime 2^61 - 1
+
+    Unlike `PolynomialHash`, the hash of the next window is computed
+    from the previous one in O(1), so scanning a text costs O(|T|).
+    """
+    q = 2 ** 61 - 1
+    x = random.randint(2 ** 16, q - 1)
+
+    def __init__(self, string):
+        self.string = string
+
+    @property
+    def hash(self):
+        """Polynomial hash of the whole string by Horner's method
+
+        >>> rolling_hash = RollingHash('abc')
+        >>> rolling_hash.x = 10
+        >>> rolling_hash.hash
+        10779
+        """
+        hash = 0
+
+        for code in _codes(self.string):
+            hash = (hash * self.x + code) % self.q
+
+        return hash
+
+    @classmethod
+    def windows(cls, text, size, start=0, stop=None):
+        """Yields `(index, hash)` for every window of `size` letters
+
+        Only windows lying inside `text[start:stop]` are hashed.
+
+        >>> windows = RollingHash.windows('abcd', 3)
+        >>> [hash for index, hash in windows] == [RollingHash('abc').hash, RollingHash('bcd').hash]
+        True
+        >>> [index for index, hash in RollingHash.windows(b'abcd', 2, start=1)]
+        [1, 2]
+        """
+        stop = len(text) if stop is None else min(stop, len(text))
+
+        if size == 0:
+            for index in range(start, stop + 1):
+                yield index, 0
+            return
+
+        if size > stop - start:
+            return
+
+        # x^(size-1) is the weight of the letter leaving the window
+        high = pow(cls.x, size - 1, cls.q)
+        incoming = _codes(text, start, stop)
+        outgoing = _codes(text, start, stop)
+
+        hash = 0
+        for code in islice(incoming, size):
+            hash = (hash * cls.x + code) % cls.q
+        yield start, hash
+
+        for index, old, new in zip(count(start + 1), outgoing, incoming):
+            hash = ((hash - old * high) * cls.x + new) % cls.q
+            yield index, hash
+
+
+class VectorizedHash:
+    """Polynomial hashes of many windows or strings at once with NumPy
+
+    The hash is the same Horner polynomial as in `RollingHash`, but
+    modulo the Mersenne prime 2^31 - 1, so the product of two residues
+    fits into int64. Every window is hashed as the difference of two
+    prefix sums of c_j * x^(N-1-j), scaled back by a power of x^-1.
+    """
+    q = 2 ** 31 - 1
+    x = random.randint(2 ** 16, q - 1)
+
+    @classmethod
+    def _powers(cls, base, size):
+        """Returns [1, base, base^2, ..., base^size] modulo q"""
+        powers = np.ones(size + 1, dtype=np.int64)
+        filled, step = 1, base % cls.q
+
+        # Doubling: powers[k:2k] = powers[:k] * base^k
+        while filled <= size:
+            count = min(filled, size + 1 - filled)
+            powers[filled: filled + count] = powers[:count] * step % cls.q
+            filled, step = filled + count, step * step % cls.q
+
+        return powers
+
+    @classmethod
+    def _prefix_hashes(cls, codes):
+        """Returns prefix sums of c_j * x^(N-1-j) and the powers of x^-1"""
+        size = len(codes)
+        weights = cls._powers(cls.x, size)[::-1][1:]
+
+        # Each term is below 2^31, so the running sum can not overflow int64
+        prefix = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(codes * weights % cls.q, out=prefix[1:])
+        prefix %= cls.q
+
+        return prefix, cls._powers(pow(cls.x, cls.q - 2, cls.q), size)
+
+    @classmethod
+    def _to_codes(cls, text):
+        if isinstance(text, str):
+            return np.frombuffer(text.encode('utf-32-le'), dtype='<u4').astype(np.int64)
+        return np.frombuffer(text, dtype=np.uint8).astype(np.int64)
+
+    @classmethod
+    def windows(cls, text, size):
+        """Returns an array with the hash of every window of `size` letters
+
+        >>> hashes = VectorizedHash.windows('abcd', 3)
+        >>> hashes.tolist() == VectorizedHash.batch(['abc', 'bcd']).tolist()
+        True
+        """
+        codes = cls._to_codes(text)
+        if size > len(codes):
+            return np.zeros(0, dtype=np.int64)
+
+        prefix, inverse = cls._prefix_hashes(codes)
+        ends = np.arange(size, len(codes) + 1)
+        hashes = (prefix[ends] - prefix[ends - size]) % cls.q
+
+        return hashes * inverse[len(codes) - ends] % cls.q
+
+    @classmethod
+    def batch(cls, strings):
+        """Returns an array with the hash of every string in `strings`
+
+        >>> VectorizedHash.batch(['ab', '', 'ab']).tolist()[1]
+        0
+        """
+        strings = list(strings)
+        empty = strings[0][:0] if strings else ''
+        codes = cls._to_codes(empty.join(strings))
+        prefix, inverse = cls._prefix_hashes(codes)
+
+        lengths = np.array([len(string) for string in strings], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        hashes = (prefix[ends] - prefix[starts]) % cls.q
+
+        return hashes * inverse[len(codes) - ends] % cls.q
+
+
+class PatternTable:
+    """Rolling hashes of patterns grouped by pattern length
+
+    `buckets` maps every distinct length to a `{hash: [pattern ids]}`
+    table, so a text window is hashed once per distinct length and
+    looked up in O(1) instead of being compared with every pattern.
+    `collisions` counts hash hits that failed the string comparison.
+
+    >>> table = PatternTable(['bla', 'and', 'nothing'])
+    >>> sorted(table.buckets)
+    [3, 7]
+    >>> sorted(table.scan('bla bla and bla'))
+    [(0, 0), (0, 4), (0, 12), (1, 8)]
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.buckets = {}
+        self.collisions = 0
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            hashes = self.buckets.setdefault(len(pattern), {})
+            hashes.setdefault(RollingHash(pattern).hash, []).append(pattern_id)
+
+    def scan(self, text, seen=None, start=0, stop=None):
+        """Yields `(pattern_id, index)` for every occurrence in `text`
+
+        Only `text[start:stop]` is scanned. `seen` is the number of
+        leading letters of `text` that were already scanned, windows
+        lying entirely inside them are skipped.
+        """
+        for size, hashes in self.buckets.items():
+            first = start if seen is None else max(seen - size + 1, start)
+
+            for index, hash in RollingHash.windows(text, size, first, stop):
+                for pattern_id in hashes.get(hash, ()):
+                    pattern = self.patterns[pattern_id]
+                    if text[index: index + size] == pattern:
+                        yield pattern_id, index
+                    else:
+                        self.collisions += 1
+
+
 def search_rabin_naive(text, pattern):
     """Implements the Rabin-Karp algorithm
 
@@ -67,27 +277,263 @@ def search_rabin_multi(text, patterns):
     """Implements the Rabin-Karp algorithm with multi-search
 
     This implementation can search for several patterns in a string,
-    returning a list of occurrences for each pattern.
+    returning a list of occurrences for each pattern. Every text window
+    is hashed in O(1) from the previous one with `RollingHash`, once
+    per distinct pattern length (see `PatternTable`).
 
     >>> search_rabin_multi('hello world, hello', ['hello', 'world'])
     [[0, 13], [6]]
     >>> search_rabin_multi('bla bla and bla', ['bla', 'nothing'])
     [[0, 4, 12], []]
     """
-    indices = []
-    hash_patterns = (PolynomialHash(pattern) for pattern in patterns)
+    table = PatternTable(patterns)
+    indices = [[] for _ in table.patterns]
 
-    for pattern in hash_patterns:
-        text_patterns = (
-            [index, PolynomialHash(text[index: index + len(pattern.string)])]
-                for index in range(len(text) - len(pattern.string) + 1)
-        )
-        indices.append([i for i, tp in text_patterns if tp.hash == pattern.hash and tp.string == pattern.string])
+    # Windows are scanned left to right, so every list comes out sorted
+    for pattern_id, index in table.scan(text):
+        indices[pattern_id].append(index)
 
     return indices
 
 
 
+def search_rabin_vectorized(text, patterns):
+    """Implements the Rabin-Karp multi-search with NumPy
+
+    All windows of one length are hashed by `VectorizedHash` in a single
+    call, candidates are selected with `np.isin` and verified as strings.
+
+    >>> search_rabin_vectorized('hello world, hello', ['hello', 'world'])
+    [[0, 13], [6]]
+    >>> search_rabin_vectorized('bla bla and bla', ['bla', 'nothing'])
+    [[0, 4, 12], []]
+    """
+    patterns = list(patterns)
+    indices = [[] for _ in patterns]
+    buckets = {}
+
+    for pattern_id, hash in enumerate(VectorizedHash.batch(patterns).tolist()):
+        hashes = buckets.setdefault(len(patterns[pattern_id]), {})
+        hashes.setdefault(hash, []).append(pattern_id)
+
+    for size, hashes in buckets.items():
+        window_hashes = VectorizedHash.windows(text, size)
+        candidates = np.flatnonzero(np.isin(window_hashes, list(hashes)))
+
+        for index, hash in zip(candidates.tolist(), window_hashes[candidates].tolist()):
+            for pattern_id in hashes[hash]:
+                if text[index: index + size] == patterns[pattern_id]:
+                    indices[pattern_id].append(index)
+
+    return indices
+
+
+def _read_chunks(file, chunk_size):
+    chunk = file.read(chunk_size)
+    while chunk:
+        yield chunk
+        chunk = file.read(chunk_size)
+
+
+def search_rabin_stream(chunks, patterns, chunk_size=2 ** 16, table=None):
+    """Implements the Rabin-Karp multi-search over a stream of chunks
+
+    `chunks` is an iterable of strings (or bytes) or a file object,
+    which is read by `chunk_size`. Occurrences are yielded as
+    `(pattern_id, offset)` in the order of offsets, where `offset`
+    is counted from the start of the stream; the ones starting in
+    the last letters of a chunk are yielded with the next chunk,
+    when no longer pattern can start before them. Only the last
+    max(|Pi|) - 1 letters are kept between chunks, so the memory is
+    bounded by the chunk size plus the longest pattern. `table` is
+    an optional `PatternTable` of `patterns` to scan with, its
+    `collisions` are counted over the whole stream.
+
+    >>> list(search_rabin_stream(['hello wo', 'rld, hel', 'lo'], ['hello', 'world']))
+    [(0, 0), (1, 6), (0, 13)]
+    >>> import io
+    >>> list(search_rabin_stream(io.BytesIO(b'bla bla'), [b'la'], chunk_size=3))
+    [(0, 1), (0, 5)]
+    """
+    if hasattr(chunks, 'read'):
+        chunks = _read_chunks(chunks, chunk_size)
+
+    if table is None:
+        table = PatternTable(patterns)
+    overlap = max([len(pattern) - 1 for pattern in table.patterns] + [0])
+
+    # `tail` is the end of the previous chunks, `offset` is its position
+    tail = None
+    offset = 0
+    # Matches starting in the tail wait for the next chunk, where longer
+    # patterns may still start before them
+    pending = []
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+
+        if tail is None:
+            buffer, seen = chunk, None
+        else:
+            buffer, seen = tail + chunk, len(tail)
+
+        matches = pending + [(pattern_id, offset + index) for pattern_id, index in table.scan(buffer, seen)]
+        matches.sort(key=itemgetter(1))
+
+        tail = buffer[max(len(buffer) - overlap, 0):]
+        offset += len(buffer) - len(tail)
+
+        pending = [match for match in matches if match[1] >= offset]
+        for match in matches[:len(matches) - len(pending)]:
+            yield match
+
+    for match in pending:
+        yield match
+
+
+def _search_file_range(args):
+    """Scans `path[start:stop]` through mmap, runs in a worker process
+
+    Returns the occurrences and the number of hash collisions.
+    """
+    path, patterns, start, stop, seen = args
+    table = PatternTable(patterns)
+
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return list(table.scan(b'')), table.collisions
+
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return list(table.scan(data, seen, start=start, stop=stop)), table.collisions
+        finally:
+            data.close()
+
+
+def search_file(path, patterns, workers=1, return_collisions=False):
+    """Implements the Rabin-Karp multi-search over a file on disk
+
+    The file is memory-mapped and scanned as bytes, so `patterns` must
+    be bytes and the returned indices are byte offsets, one list per
+    pattern as in `search_rabin_multi`. With `workers` > 1 the file is
+    split into byte ranges overlapping by max(|Pi|) - 1, which are
+    scanned by a pool of processes. Windows lying entirely inside a
+    seam are scanned only by the range before it. With
+    `return_collisions` the number of hash hits rejected by the string
+    comparison is returned as well.
+    """
+    patterns = list(patterns)
+    size = os.path.getsize(path)
+    overlap = max([len(pattern) - 1 for pattern in patterns] + [0])
+
+    step = max(-(-size // workers), 1)
+    ranges = [(path, patterns, start, start + step + overlap, start + overlap if start else None)
+              for start in range(0, size, step)] or [(path, patterns, 0, 0, None)]
+
+    if workers > 1 and len(ranges) > 1:
+        pool = multiprocessing.Pool(min(workers, len(ranges)))
+        try:
+            results = pool.map(_search_file_range, ranges)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_search_file_range(arguments) for arguments in ranges]
+
+    indices = [[] for _ in patterns]
+    for matches, _ in results:
+        for pattern_id, index in matches:
+            indices[pattern_id].append(index)
+
+    indices = [sorted(found) for found in indices]
+    if return_collisions:
+        return indices, sum(collisions for _, collisions in results)
+    return indices
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton over a fixed list of patterns
+
+    The automaton is built once in O(sum |Pi|) and then finds every
+    pattern in a single pass over the text, so it can be reused for
+    many texts with the same dictionary.
+
+    >>> automaton = AhoCorasick(['he', 'she', 'hers'])
+    >>> automaton.search('ushers')
+    [[2], [1], [2]]
+    >>> automaton.search('he said')
+    [[0], [], []]
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            node = 0
+            for letter in pattern:
+                if letter not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][letter] = len(self._goto) - 1
+                node = self._goto[node][letter]
+            self._output[node].append(pattern_id)
+
+        # Children of the root fail to the root, so they also end its
+        # patterns, the empty ones
+        for child in self._goto[0].values():
+            self._output[child] = self._output[child] + self._output[0]
+
+        # Breadth-first, so the failure link of a parent is always ready
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for letter, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and letter not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(letter, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def search(self, text):
+        """Returns a list of occurrences for each pattern in `text`"""
+        indices = [[] for _ in self.patterns]
+
+        # Empty patterns live in the root and match before every letter
+        for pattern_id in self._output[0]:
+            indices[pattern_id].append(0)
+
+        node = 0
+        for index, letter in enumerate(text):
+            while node and letter not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(letter, 0)
+
+            for pattern_id in self._output[node]:
+                indices[pattern_id].append(index + 1 - len(self.patterns[pattern_id]))
+
+        return indices
+
+
+def search_aho_corasick(text, patterns):
+    """Implements the multi-search with the Aho-Corasick automaton
+
+    Returns the same list of occurrences for each pattern as
+    `search_rabin_multi`, but scans the text only once.
+
+    >>> search_aho_corasick('hello world, hello', ['hello', 'world'])
+    [[0, 13], [6]]
+    >>> search_aho_corasick('bla bla and bla', ['bla', 'nothing'])
+    [[0, 4, 12], []]
+    """
+    return AhoCorasick(patterns).search(text)
+
+
 if __name__ == '__main__':
     import doctest
-    doctest.testmod()
\ No newline at end of file
+    doctest.testmod()
@@ -1,7 +1,12 @@
 #-*- coding: utf-8 -*-
+import io
+import os
+import random
+import tempfile
 import unittest
 
-from rabin import search_rabin_multi
+from rabin import (AhoCorasick, VectorizedHash, search_aho_corasick, search_file,
+                   search_rabin_multi, search_rabin_stream, search_rabin_vectorized)
 
 
 class TestRabinKarpMultiSearch(unittest.TestCase):
@@ -29,6 +34,126 @@ class TestRabinKarpMultiSearch(unittest.TestCase):
     def test_check_correct_structure_in_return_value(self):
         self.assertEqual(search_rabin_multi(self.text, ['If', 'there']), [[0], [3, 20]])
 
+    def test_overlapping_occurrences(self):
+        self.assertEqual(search_rabin_multi('aaaa', ['aa', 'aaaaa']), [[0, 1, 2], []])
+
+    def test_patterns_of_same_length(self):
+        self.assertEqual(search_rabin_multi(self.text, ['is', 'If', 'is']), [[9, 26], [0], [9, 26]])
+
+
+
+class TestAhoCorasickSearch(unittest.TestCase):
+    def setUp(self):
+        self.text = 'If there is a will, there is a way'
+
+    def test_search_with_empty_patterns(self):
+        self.assertEqual(search_aho_corasick(self.text, []), [])
+
+    def test_same_result_as_rabin_multi(self):
+        patterns = ['If', 'there', 'is', 'a', 'way', 'nothing', 'here']
+        self.assertEqual(search_aho_corasick(self.text, patterns),
+                         search_rabin_multi(self.text, patterns))
+
+    def test_empty_pattern(self):
+        self.assertEqual(search_aho_corasick('ab', ['']), search_rabin_multi('ab', ['']))
+        for text in ('aa', 'ab', 'ba', self.text):
+            patterns = ['', 'a', 'is', '']
+            self.assertEqual(search_aho_corasick(text, patterns), search_rabin_multi(text, patterns))
+
+    def test_automaton_is_reusable(self):
+        automaton = AhoCorasick(['is', 'way'])
+        self.assertEqual(automaton.search(self.text), [[9, 26], [31]])
+        self.assertEqual(automaton.search('This way'), [[2], [5]])
+
+
+class TestRabinKarpStreamSearch(unittest.TestCase):
+    def setUp(self):
+        self.text = 'If there is a will, there is a way'
+        self.patterns = ['If', 'there', 'is a', 'way', 'y', '']
+
+    def _expected(self, text, patterns):
+        indices = search_rabin_multi(text, patterns)
+        return sorted(((pattern_id, index) for pattern_id, found in enumerate(indices) for index in found),
+                      key=lambda match: match[1])
+
+    def test_same_result_as_rabin_multi(self):
+        for size in range(1, len(self.text) + 1):
+            chunks = [self.text[i: i + size] for i in range(0, len(self.text), size)]
+            self.assertEqual(
+                sorted(search_rabin_stream(chunks, self.patterns)),
+                sorted(self._expected(self.text, self.patterns))
+            )
+
+    def test_offsets_are_ordered(self):
+        matches = list(search_rabin_stream([self.text[:10], self.text[10:]], ['is', 'a']))
+        self.assertEqual([offset for _, offset in matches], sorted(offset for _, offset in matches))
+        self.assertEqual(list(search_rabin_stream(['abcdef', 'gh'], ['cdefg', 'f'])), [(0, 2), (1, 5)])
+
+    def test_binary_file(self):
+        random.seed(17)
+        data = bytes(bytearray(random.choice(b'ab') for _ in range(1000)))
+        patterns = [b'abba', b'bab', b'aaaaa']
+        self.assertEqual(
+            sorted(search_rabin_stream(io.BytesIO(data), patterns, chunk_size=7)),
+            sorted(self._expected(data, patterns))
+        )
+
+
+class TestRabinKarpFileSearch(unittest.TestCase):
+    def setUp(self):
+        random.seed(17)
+        self.data = bytes(bytearray(random.choice(b'ab') for _ in range(5000)))
+        self.patterns = [b'abba', b'bab', b'aaaaaa', b'nothing']
+
+        file = tempfile.NamedTemporaryFile(delete=False)
+        file.write(self.data)
+        file.close()
+        self.path = file.name
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_same_result_as_rabin_multi(self):
+        self.assertEqual(search_file(self.path, self.patterns),
+                         search_rabin_multi(self.data, self.patterns))
+
+    def test_matches_at_range_seams_are_merged(self):
+        self.assertEqual(search_file(self.path, self.patterns, workers=3),
+                         search_rabin_multi(self.data, self.patterns))
+
+    def test_empty_file(self):
+        with open(self.path, 'wb'):
+            pass
+        self.assertEqual(search_file(self.path, [b'a'], workers=2), [[]])
+
+
+class TestVectorizedHash(unittest.TestCase):
+    def setUp(self):
+        self.text = 'If there is a will, there is a way'
+
+    def _horner(self, string):
+        hash = 0
+        for letter in string:
+            hash = (hash * VectorizedHash.x + ord(letter)) % VectorizedHash.q
+        return hash
+
+    def test_batch_matches_horner_hash(self):
+        strings = ['If', '', 'there', u'w\xe4y']
+        self.assertEqual(VectorizedHash.batch(strings).tolist(), [self._horner(string) for string in strings])
+
+    def test_windows_match_batch(self):
+        windows = [self.text[i: i + 5] for i in range(len(self.text) - 4)]
+        self.assertEqual(VectorizedHash.windows(self.text, 5).tolist(), VectorizedHash.batch(windows).tolist())
+
+    def test_window_longer_than_text(self):
+        self.assertEqual(len(VectorizedHash.windows('abc', 4)), 0)
+
+    def test_search_same_result_as_rabin_multi(self):
+        patterns = ['If', 'there', 'is a', 'way', 'y', '', 'nothing']
+        self.assertEqual(search_rabin_vectorized(self.text, patterns),
+                         search_rabin_multi(self.text, patterns))
+        self.assertEqual(search_rabin_vectorized(self.text.encode(), [pattern.encode() for pattern in patterns]),
+                         search_rabin_multi(self.text, patterns))
 
 
 if __name__ == '__main__':